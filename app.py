@@ -4,7 +4,7 @@ A comprehensive web-based application for managing customers, inventory, and bil
 """
 
 from flask import Flask, render_template
-from database import init_db
+from database import init_db, close_db
 from routes.customers import customers_bp
 from routes.inventory import inventory_bp
 from routes.billing import billing_bp
@@ -14,6 +14,12 @@ from routes.purchases import purchases_bp
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
+# Reject oversized request bodies before they are parsed (1MB is far above any real bill form)
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+
+# Hand each request's database connection back to the pool
+app.teardown_appcontext(close_db)
+
 # Register blueprints
 app.register_blueprint(customers_bp)
 app.register_blueprint(inventory_bp)
@@ -2,73 +2,75 @@ import sqlite3
 
 # Connect to database
 conn = sqlite3.connect('business.db')
+# Use the same journal mode as the app before taking any locks
+conn.execute('PRAGMA journal_mode=WAL')
 cursor = conn.cursor()
 
 print("Checking current database structure...\n")
 
 # Check billing_items table structure
 print("=== billing_items table columns ===")
-cursor.execute("PRAGMA table_info(billing_items)")
-columns = cursor.fetchall()
-for col in columns:
-    print(f"  {col[1]} ({col[2]})")
+columns = {row[1]: row[2] for row in cursor.execute("PRAGMA table_info(billing_items)")}
+print("\n".join(f"  {name} ({col_type})" for name, col_type in columns.items()))
 
-has_hsn = any(col[1] == 'hsn_code' for col in columns)
+has_hsn = 'hsn_code' in columns
 print(f"\nHSN code column exists: {has_hsn}")
 
 # Check billing table structure
 print("\n=== billing table columns ===")
-cursor.execute("PRAGMA table_info(billing)")
-columns = cursor.fetchall()
-for col in columns:
-    print(f"  {col[1]} ({col[2]})")
+columns = {row[1]: row[2] for row in cursor.execute("PRAGMA table_info(billing)")}
+print("\n".join(f"  {name} ({col_type})" for name, col_type in columns.items()))
 
-has_roundoff = any(col[1] == 'round_off' for col in columns)
+has_roundoff = 'round_off' in columns
 print(f"\nRound off column exists: {has_roundoff}")
 
 print("\n" + "="*50)
 print("Starting migration...\n")
 
-# Add hsn_code if missing
-if not has_hsn:
-    try:
-        print("Adding hsn_code column to billing_items...")
-        cursor.execute('ALTER TABLE billing_items ADD COLUMN hsn_code TEXT')
-        conn.commit()
-        print("✓ hsn_code column added successfully")
-    except Exception as e:
-        print(f"✗ Error adding hsn_code: {e}")
-else:
-    print("✓ hsn_code column already exists")
+# Apply all migrations in a single transaction (committed when the block exits)
+with conn:
+    cursor.execute("BEGIN")
 
-# Add round_off if missing
-if not has_roundoff:
-    try:
-        print("Adding round_off column to billing...")
-        cursor.execute('ALTER TABLE billing ADD COLUMN round_off REAL DEFAULT 0.0')
-        conn.commit()
-        print("✓ round_off column added successfully")
-    except Exception as e:
-        print(f"✗ Error adding round_off: {e}")
-else:
-    print("✓ round_off column already exists")
+    # Add hsn_code if missing
+    if not has_hsn:
+        try:
+            print("Adding hsn_code column to billing_items...")
+            cursor.execute('ALTER TABLE billing_items ADD COLUMN hsn_code TEXT')
+            print("✓ hsn_code column added successfully")
+        except sqlite3.OperationalError as e:
+            if "duplicate column name" in str(e).lower():
+                print("✓ hsn_code column already exists")
+            else:
+                print(f"✗ Error adding hsn_code: {e}")
+    else:
+        print("✓ hsn_code column already exists")
+
+    # Add round_off if missing
+    if not has_roundoff:
+        try:
+            print("Adding round_off column to billing...")
+            cursor.execute('ALTER TABLE billing ADD COLUMN round_off REAL DEFAULT 0.0')
+            print("✓ round_off column added successfully")
+        except sqlite3.OperationalError as e:
+            if "duplicate column name" in str(e).lower():
+                print("✓ round_off column already exists")
+            else:
+                print(f"✗ Error adding round_off: {e}")
+    else:
+        print("✓ round_off column already exists")
 
 print("\n" + "="*50)
 print("Verifying final structure...\n")
 
 # Verify billing_items
 print("=== billing_items final columns ===")
-cursor.execute("PRAGMA table_info(billing_items)")
-columns = cursor.fetchall()
-for col in columns:
-    print(f"  {col[1]} ({col[2]})")
+columns = cursor.execute("PRAGMA table_info(billing_items)").fetchall()
+print("\n".join(f"  {col[1]} ({col[2]})" for col in columns))
 
 # Verify billing
 print("\n=== billing final columns ===")
-cursor.execute("PRAGMA table_info(billing)")
-columns = cursor.fetchall()
-for col in columns:
-    print(f"  {col[1]} ({col[2]})")
+columns = cursor.execute("PRAGMA table_info(billing)").fetchall()
+print("\n".join(f"  {col[1]} ({col[2]})" for col in columns))
 
 conn.close()
 print("\nMigration completed!")
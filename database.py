@@ -3,23 +3,142 @@ Database module for Business Management System
 Handles all database connections and initialization
 """
 
-import sqlite3
+import atexit
+import threading
+import time
+from flask import g, has_app_context
+
+# Prefer pysqlite3 (newer bundled SQLite) when it is installed
+try:
+    from pysqlite3 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
 
 # Database configuration
 DATABASE = 'business.db'
 
-def get_db_connection():
-    """Create a database connection"""
-    conn = sqlite3.connect(DATABASE)
+# Bump whenever init_db() gains a new table, column or index
+SCHEMA_VERSION = 10
+
+# Oldest SQLite with everything the schema and routes rely on: UPDATE ... FROM
+# (3.33), the FTS5 trigram tokenizer (3.34) and RETURNING (3.35)
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# Number of idle connections kept open for reuse
+POOL_SIZE = 5
+
+_pool = []
+_pool_lock = threading.Lock()
+
+# Changes whenever a released connection has written rows; seeded from the
+# clock so values from a previous process are never reused (safe for ETags).
+# It is per process and only sees writes made through this pool: the ETags and
+# caches built on it assume a single server process, and scripts that write to
+# the database directly (migrate_db.py, check_and_migrate.py) need a restart
+_data_version = time.time_ns()
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection that is returned to the pool instead of being closed"""
+    request_bound = False
+    changes_seen = 0
+    
+    def close(self):
+        # Connections owned by a request are released by close_db at teardown
+        if self.request_bound:
+            return
+        release_connection(self)
+
+def _connect():
+    """Open a new pooled connection with the performance settings applied"""
+    # A larger statement cache keeps every route's prepared SQL (including the
+    # IN (...) variants of different lengths) from evicting each other
+    conn = sqlite3.connect(DATABASE, factory=PooledConnection, check_same_thread=False,
+                           cached_statements=256)
     conn.row_factory = sqlite3.Row
+
+    # Performance settings: synchronous=NORMAL only syncs at WAL checkpoints
+    # instead of every commit (WAL itself is switched on once by init_db)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-64000')  # 64MB page cache
+    conn.execute('PRAGMA mmap_size=268435456')  # 256MB memory-mapped I/O
     return conn
 
-def init_db():
-    """Initialize the database with all required tables"""
-    conn = get_db_connection()
+def _acquire():
+    """Take an idle connection from the pool or open a new one"""
+    with _pool_lock:
+        if _pool:
+            return _pool.pop()
+    return _connect()
+
+def release_connection(conn):
+    """Discard uncommitted work and put the connection back in the pool"""
+    conn.rollback()
+    conn.row_factory = sqlite3.Row
+    if conn.total_changes != conn.changes_seen:
+        conn.changes_seen = conn.total_changes
+        bump_data_version()
+    with _pool_lock:
+        if len(_pool) < POOL_SIZE:
+            _pool.append(conn)
+            return
+    _close(conn)
+
+def bump_data_version():
+    """Mark cached query results as stale (for writes that change no rows, like DROP TABLE)"""
+    global _data_version
+    with _pool_lock:
+        _data_version += 1
+
+def data_version():
+    """Return a counter that changes after every database write made through the pool"""
+    return _data_version
+
+def _close(conn):
+    """Refresh planner statistics and really close a connection"""
+    conn.execute('PRAGMA optimize')
+    sqlite3.Connection.close(conn)
+
+@atexit.register
+def close_pool():
+    """Close every idle pooled connection"""
+    with _pool_lock:
+        idle = list(_pool)
+        _pool.clear()
+    for conn in idle:
+        _close(conn)
+
+def get_db_connection():
+    """Get a database connection (shared for the duration of a request)"""
+    if not has_app_context():
+        return _acquire()
     
+    if 'db' not in g:
+        g.db = _acquire()
+        g.db.request_bound = True
+    return g.db
+
+def get_db_connection_fast():
+    """Get a connection that returns plain tuples instead of Row objects.
+    
+    Meant for bulk exports and reports that read many rows; the caller must
+    close() it. Display and admin routes should keep using get_db_connection().
+    """
+    conn = _acquire()
+    conn.row_factory = None
+    return conn
+
+def close_db(exception=None):
+    """Return the request's connection to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.request_bound = False
+        release_connection(conn)
+
+# Table definitions, shared by init_db() and the admin reset tools
+TABLE_SCHEMAS = {
     # Customers table
-    conn.execute('''
+    'customers': '''
         CREATE TABLE IF NOT EXISTS customers (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             customer_id TEXT UNIQUE NOT NULL,
@@ -32,10 +151,9 @@ def init_db():
             gst_number TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
+    ''',
     # Inventory table
-    conn.execute('''
+    'inventory': '''
         CREATE TABLE IF NOT EXISTS inventory (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             product_id TEXT UNIQUE NOT NULL,
@@ -51,18 +169,9 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Add buy_price column to existing inventory table if it doesn't exist
-    try:
-        conn.execute('SELECT buy_price FROM inventory LIMIT 1')
-    except sqlite3.OperationalError:
-        # Column doesn't exist, add it with default value 0.0
-        conn.execute('ALTER TABLE inventory ADD COLUMN buy_price REAL NOT NULL DEFAULT 0.0')
-        conn.commit()
-    
+    ''',
     # Billing table (header - one per bill)
-    conn.execute('''
+    'billing': '''
         CREATE TABLE IF NOT EXISTS billing (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             bill_id TEXT UNIQUE NOT NULL,
@@ -77,27 +186,9 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (customer_id) REFERENCES customers (id)
         )
-    ''')
-    
-    # Add bill_id column to existing billing table if it doesn't exist
-    try:
-        conn.execute('SELECT bill_id FROM billing LIMIT 1')
-    except sqlite3.OperationalError:
-        # Column doesn't exist, add it
-        conn.execute('ALTER TABLE billing ADD COLUMN bill_id TEXT')
-        # Generate bill_ids for existing records
-        existing_bills = conn.execute('SELECT id FROM billing ORDER BY id').fetchall()
-        for idx, bill in enumerate(existing_bills, start=1):
-            bill_id = f'ST{idx}'
-            conn.execute('UPDATE billing SET bill_id = ? WHERE id = ?', (bill_id, bill['id']))
-        # Make bill_id unique after populating
-        conn.execute('''
-            CREATE UNIQUE INDEX IF NOT EXISTS idx_billing_bill_id ON billing(bill_id)
-        ''')
-        conn.commit()
-    
+    ''',
     # Billing items table (line items - multiple per bill)
-    conn.execute('''
+    'billing_items': '''
         CREATE TABLE IF NOT EXISTS billing_items (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             bill_id INTEGER NOT NULL,
@@ -115,43 +206,9 @@ def init_db():
             FOREIGN KEY (bill_id) REFERENCES billing (id) ON DELETE CASCADE,
             FOREIGN KEY (product_id) REFERENCES inventory (id)
         )
-    ''')
-    
-    # Add CGST, SGST, IGST columns to existing billing_items table if they don't exist
-    try:
-        conn.execute('SELECT cgst FROM billing_items LIMIT 1')
-    except sqlite3.OperationalError:
-        conn.execute('ALTER TABLE billing_items ADD COLUMN cgst REAL NOT NULL DEFAULT 0.0')
-        conn.commit()
-    
-    try:
-        conn.execute('SELECT sgst FROM billing_items LIMIT 1')
-    except sqlite3.OperationalError:
-        conn.execute('ALTER TABLE billing_items ADD COLUMN sgst REAL NOT NULL DEFAULT 0.0')
-        conn.commit()
-    
-    try:
-        conn.execute('SELECT igst FROM billing_items LIMIT 1')
-    except sqlite3.OperationalError:
-        conn.execute('ALTER TABLE billing_items ADD COLUMN igst REAL NOT NULL DEFAULT 0.0')
-        conn.commit()
-    
-    # Add hsn_code column to existing billing_items table if it doesn't exist
-    try:
-        conn.execute('SELECT hsn_code FROM billing_items LIMIT 1')
-    except sqlite3.OperationalError:
-        conn.execute('ALTER TABLE billing_items ADD COLUMN hsn_code TEXT')
-        conn.commit()
-    
-    # Add round_off column to existing billing table if it doesn't exist
-    try:
-        conn.execute('SELECT round_off FROM billing LIMIT 1')
-    except sqlite3.OperationalError:
-        conn.execute('ALTER TABLE billing ADD COLUMN round_off REAL DEFAULT 0.0')
-        conn.commit()
-    
+    ''',
     # Seller information table
-    conn.execute('''
+    'seller_info': '''
         CREATE TABLE IF NOT EXISTS seller_info (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             seller_name TEXT NOT NULL,
@@ -168,28 +225,9 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Add state column to existing seller_info table if it doesn't exist
-    try:
-        conn.execute('SELECT state FROM seller_info LIMIT 1')
-    except sqlite3.OperationalError:
-        # Column doesn't exist, add it with default value
-        conn.execute('ALTER TABLE seller_info ADD COLUMN state TEXT')
-        conn.commit()
-    
-    # Insert default seller info if table is empty
-    existing_seller = conn.execute('SELECT COUNT(*) as count FROM seller_info').fetchone()
-    if existing_seller['count'] == 0:
-        conn.execute('''INSERT INTO seller_info (seller_name, address, email, mobile, gst_number,
-                        account_name, account_number, ifsc_code, account_type, branch)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    ('Your Company Name', 'Your Address', 'email@example.com', '1234567890', 'GST123456',
-                     'Account Holder Name', '1234567890', 'IFSC0001234', 'Savings', 'Main Branch'))
-        conn.commit()
-    
+    ''',
     # Purchase table - tracks all purchases/stock additions
-    conn.execute('''
+    'purchases': '''
         CREATE TABLE IF NOT EXISTS purchases (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             product_id TEXT NOT NULL,
@@ -206,9 +244,220 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (product_id) REFERENCES inventory (product_id)
         )
+    ''',
+}
+
+# Indexes for the foreign key and lookup columns used by joins and filters
+TABLE_INDEXES = {
+    'billing': [
+        'CREATE INDEX IF NOT EXISTS idx_billing_customer_id ON billing(customer_id)',
+        'CREATE INDEX IF NOT EXISTS idx_billing_date ON billing(bill_date)',
+        'CREATE INDEX IF NOT EXISTS idx_billing_created_at ON billing(created_at DESC)',
+        # Partial indexes matching the bill list filters, newest first for paging
+        "CREATE INDEX IF NOT EXISTS idx_billing_active_created ON billing(created_at DESC) WHERE payment_status != 'Cancelled'",
+        "CREATE INDEX IF NOT EXISTS idx_billing_cancelled_created ON billing(created_at DESC) WHERE payment_status = 'Cancelled'",
+        # Numeric part of automatic ST### bill ids, so the next number is one index probe
+        "CREATE INDEX IF NOT EXISTS idx_billing_st_number ON billing(CAST(SUBSTR(bill_id, 3) AS INTEGER)) WHERE bill_id GLOB 'ST[0-9]*'",
+    ],
+    'inventory': [
+        # Partial index: in-stock products already in name order for the bill form
+        'CREATE INDEX IF NOT EXISTS idx_inventory_instock_name ON inventory(product_name) WHERE quantity > 0',
+        # Purchase lookup of an existing batch by name and manufacture date
+        'CREATE INDEX IF NOT EXISTS idx_inventory_name_mfg ON inventory(product_name, manufacture_date)',
+        'CREATE INDEX IF NOT EXISTS idx_inventory_created_at ON inventory(created_at DESC)',
+    ],
+    'billing_items': [
+        # Covers the per-bill product/quantity reads used to restore and adjust stock
+        'CREATE INDEX IF NOT EXISTS idx_billing_items_bill_product ON billing_items(bill_id, product_id, quantity)',
+        'CREATE INDEX IF NOT EXISTS idx_billing_items_product_id ON billing_items(product_id)',
+    ],
+    'purchases': [
+        'CREATE INDEX IF NOT EXISTS idx_purchases_product_id ON purchases(product_id)',
+        # Matches the purchase list order, newest first for paging
+        'CREATE INDEX IF NOT EXISTS idx_purchases_date ON purchases(purchase_date DESC, created_at DESC)',
+    ],
+}
+
+# Full-text search indexes, keyed by the table they mirror. The trigram
+# tokenizer matches any substring of three or more characters, so searches
+# don't have to scan the table with LIKE '%...%'. Rebuilding after the table
+# is created or migrated keeps an external-content index in sync with it
+TABLE_SEARCH_INDEXES = {
+    'customers': [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+               customer_id, vendor_code, name,
+               content='customers', content_rowid='id', tokenize='trigram')''',
+        "INSERT INTO customers_fts(customers_fts) VALUES('rebuild')",
+    ],
+}
+
+# Triggers, keyed by the table they fire on. billing_items references the
+# TEXT bill_id, which the declared foreign key (on billing.id) doesn't match,
+# so deleting a bill removes its items here instead of through a cascade
+TABLE_TRIGGERS = {
+    'billing': [
+        '''CREATE TRIGGER IF NOT EXISTS trg_billing_delete_items AFTER DELETE ON billing
+           BEGIN
+               DELETE FROM billing_items WHERE bill_id = OLD.bill_id;
+           END''',
+    ],
+    # Keep customers_fts in step with every customer write
+    'customers': [
+        '''CREATE TRIGGER IF NOT EXISTS trg_customers_fts_insert AFTER INSERT ON customers
+           BEGIN
+               INSERT INTO customers_fts(rowid, customer_id, vendor_code, name)
+               VALUES (NEW.id, NEW.customer_id, NEW.vendor_code, NEW.name);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_customers_fts_delete AFTER DELETE ON customers
+           BEGIN
+               INSERT INTO customers_fts(customers_fts, rowid, customer_id, vendor_code, name)
+               VALUES ('delete', OLD.id, OLD.customer_id, OLD.vendor_code, OLD.name);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_customers_fts_update AFTER UPDATE ON customers
+           BEGIN
+               INSERT INTO customers_fts(customers_fts, rowid, customer_id, vendor_code, name)
+               VALUES ('delete', OLD.id, OLD.customer_id, OLD.vendor_code, OLD.name);
+               INSERT INTO customers_fts(rowid, customer_id, vendor_code, name)
+               VALUES (NEW.id, NEW.customer_id, NEW.vendor_code, NEW.name);
+           END''',
+    ],
+}
+
+# Every table as one script so it is parsed in a single executescript() call
+_TABLES_SQL = ';\n'.join(TABLE_SCHEMAS.values()) + ';\n'
+
+# Indexes, search indexes and triggers, which can name columns that tables from
+# older releases only gain in _add_missing_columns, so they are created after it
+_DERIVED_SQL = [sql for group in (TABLE_INDEXES, TABLE_SEARCH_INDEXES, TABLE_TRIGGERS)
+                for statements in group.values() for sql in statements]
+
+def _columns(conn):
+    """Return (table, column) pairs for every table in one query"""
+    rows = conn.execute('''
+        SELECT m.name, p.name
+        FROM sqlite_master m, pragma_table_info(m.name) p
+        WHERE m.type = 'table'
     ''')
+    return {(table, column) for table, column in rows}
+
+def _add_missing_columns(conn):
+    """Bring tables created by older releases up to the current columns"""
+    existing = _columns(conn)
+    
+    # Add buy_price column to existing inventory table if it doesn't exist
+    if ('inventory', 'buy_price') not in existing:
+        # Column doesn't exist, add it with default value 0.0
+        conn.execute('ALTER TABLE inventory ADD COLUMN buy_price REAL NOT NULL DEFAULT 0.0')
+    
+    # Add bill_id column to existing billing table if it doesn't exist
+    if ('billing', 'bill_id') not in existing:
+        # Column doesn't exist, add it
+        conn.execute('ALTER TABLE billing ADD COLUMN bill_id TEXT')
+        # Generate bill_ids for existing records (ST1, ST2, ... in id order) in one statement
+        conn.execute('''
+            UPDATE billing
+            SET bill_id = 'ST' || (SELECT COUNT(*) FROM billing b2 WHERE b2.id <= billing.id)
+            WHERE bill_id IS NULL
+        ''')
+        # Make bill_id unique after populating
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_billing_bill_id ON billing(bill_id)
+        ''')
+    
+    # Add CGST, SGST, IGST columns to existing billing_items table if they don't exist
+    if ('billing_items', 'cgst') not in existing:
+        conn.execute('ALTER TABLE billing_items ADD COLUMN cgst REAL NOT NULL DEFAULT 0.0')
+    
+    if ('billing_items', 'sgst') not in existing:
+        conn.execute('ALTER TABLE billing_items ADD COLUMN sgst REAL NOT NULL DEFAULT 0.0')
+    
+    if ('billing_items', 'igst') not in existing:
+        conn.execute('ALTER TABLE billing_items ADD COLUMN igst REAL NOT NULL DEFAULT 0.0')
+    
+    # Add hsn_code column to existing billing_items table if it doesn't exist
+    if ('billing_items', 'hsn_code') not in existing:
+        conn.execute('ALTER TABLE billing_items ADD COLUMN hsn_code TEXT')
+    
+    # Add round_off column to existing billing table if it doesn't exist
+    if ('billing', 'round_off') not in existing:
+        conn.execute('ALTER TABLE billing ADD COLUMN round_off REAL DEFAULT 0.0')
+    
+    # Add state column to existing seller_info table if it doesn't exist
+    if ('seller_info', 'state') not in existing:
+        # Column doesn't exist, add it with default value
+        conn.execute('ALTER TABLE seller_info ADD COLUMN state TEXT')
+
+def _check_sqlite():
+    """Refuse to start on an SQLite library that lacks features the app needs"""
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(f'SQLite {sqlite3.sqlite_version} is too old; version '
+                           f'{".".join(map(str, MIN_SQLITE_VERSION))} or newer is required '
+                           '(pip install pysqlite3-binary provides a recent build)')
+    probe = sqlite3.connect(':memory:')
+    has_fts5 = probe.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0]
+    probe.close()
+    if not has_fts5:
+        raise RuntimeError(f'SQLite {sqlite3.sqlite_version} was built without FTS5, which customer search needs '
+                           '(pip install pysqlite3-binary provides a build with it)')
+
+def init_db(drop_tables=()):
+    """Initialize the database with all required tables, optionally dropping some first"""
+    _check_sqlite()
+    conn = get_db_connection()
+    
+    # WAL lets readers run alongside a writer; the mode is stored in the
+    # database file, so setting it once at startup covers every connection
+    conn.execute('PRAGMA journal_mode=WAL')
+    
+    # Nothing to do when the schema is already current
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version == SCHEMA_VERSION and not drop_tables:
+        conn.close()
+        return
+    
+    # Dropped tables are rebuilt from scratch, so rerun every migration step
+    drop_sql = ''.join(f'DROP TABLE IF EXISTS {table};' for table in drop_tables)
+    if drop_tables:
+        version = 0
+    
+    # Run the whole schema setup in one transaction so it costs a single commit;
+    # the with block commits on success and rolls back on any error
+    with conn:
+        conn.executescript('BEGIN IMMEDIATE;' + drop_sql + _TABLES_SQL)
+        
+        # Version 1: columns added after the first release
+        if version < 1:
+            _add_missing_columns(conn)
+        
+        # executescript() would commit first, so these run one by one inside the transaction
+        for sql in _DERIVED_SQL:
+            conn.execute(sql)
+        
+        # Version 2: seller_info keeps a single row with id 1 (the newest one)
+        if version < 2:
+            conn.execute('DELETE FROM seller_info WHERE id != (SELECT MAX(id) FROM seller_info)')
+            conn.execute('UPDATE seller_info SET id = 1')
+        
+        # Version 8: idx_billing_items_bill_product replaces the single-column bill_id index
+        if version < 8:
+            conn.execute('DROP INDEX IF EXISTS idx_billing_items_bill_id')
+        
+        # Version 10: gather statistics so the planner picks the new inventory and purchase indexes
+        if version < 10:
+            conn.execute('ANALYZE')
+        
+        # Insert default seller info if table is empty
+        conn.execute('''INSERT INTO seller_info (id, seller_name, address, email, mobile, gst_number,
+                        account_name, account_number, ifsc_code, account_type, branch)
+                        SELECT 1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                        WHERE NOT EXISTS (SELECT 1 FROM seller_info)''',
+                    ('Your Company Name', 'Your Address', 'email@example.com', '1234567890', 'GST123456',
+                     'Account Holder Name', '1234567890', 'IFSC0001234', 'Savings', 'Main Branch'))
+        
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     
-    conn.commit()
+    # Leave fresh planner statistics behind on every boot
+    conn.execute('PRAGMA optimize')
     conn.close()
 
 # Made with Bob
@@ -1,3 +1,39 @@
 # Routes package initialization
 
+from database import sqlite3
+from flask import request, session
+
+def not_modified(etag):
+    """True when the client already holds this version, unless a flash message still has to be shown"""
+    return '_flashes' not in session and etag in request.if_none_match
+
+def cacheable(response, etag):
+    """Tag a response so the browser keeps it but revalidates on every visit"""
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def insert_rows(conn, sql, rows):
+    """Insert rows inside the caller's transaction, returning the indexes of rows that broke a constraint"""
+    conn.execute('SAVEPOINT bulk_insert')
+    try:
+        conn.executemany(sql, rows)
+        conn.execute('RELEASE bulk_insert')
+        return []
+    except sqlite3.IntegrityError:
+        # executemany stops at the first bad row, so undo the batch and retry row by row
+        conn.execute('ROLLBACK TO bulk_insert')
+        conn.execute('RELEASE bulk_insert')
+    
+    failed = []
+    for index, row in enumerate(rows):
+        conn.execute('SAVEPOINT bulk_row')
+        try:
+            conn.execute(sql, row)
+        except sqlite3.IntegrityError:
+            conn.execute('ROLLBACK TO bulk_row')
+            failed.append(index)
+        conn.execute('RELEASE bulk_row')
+    return failed
+
 # Made with Bob
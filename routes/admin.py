@@ -3,36 +3,110 @@ Admin routes module
 Handles all admin and database management routes
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_db_connection, init_db
+import hashlib
+import time
+from functools import lru_cache
+from flask import Blueprint, render_template, request, redirect, url_for, flash, make_response
+from database import get_db_connection, init_db, bump_data_version, sqlite3, TABLE_SCHEMAS, TABLE_INDEXES, TABLE_SEARCH_INDEXES, TABLE_TRIGGERS
+from routes import not_modified, cacheable
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+# Drop-and-recreate script for every table that can be reset; resetting
+# user_version makes the next init_db() re-check the schema
+_RESET_DDL = {
+    table: f'BEGIN; DROP TABLE IF EXISTS {table}; PRAGMA user_version = 0; {ddl};'
+           + ''.join(f'{sql};' for sql in TABLE_INDEXES.get(table, []))
+           + ''.join(f'{sql};' for sql in TABLE_SEARCH_INDEXES.get(table, []))
+           + ''.join(f'{sql};' for sql in TABLE_TRIGGERS.get(table, []))
+    for table, ddl in TABLE_SCHEMAS.items()
+}
+
+# Tables the admin pages may touch, in dashboard order
+_TABLES = tuple(TABLE_SCHEMAS)
+_ALLOWED_TABLES = frozenset(_TABLES)
+
+# Per-table SQL built once at import instead of on every request
+_EXISTING_TABLES_SQL = f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({','.join('?' * len(_TABLES))})"
+_DASHBOARD_COUNT_SQL = {table: f"SELECT '{table}', COUNT(*) FROM {table}" for table in _TABLES}
+_COUNT_SQL = {table: f'SELECT COUNT(*) FROM {table}' for table in _TABLES}
+_TABLE_INFO_SQL = {table: f'PRAGMA table_info({table})' for table in _TABLES}
+
+# Dashboard table counts, reused for a few seconds between refreshes
+_INDEX_CACHE_TTL = 5
+_index_cache = {'time': 0.0, 'tables_info': None}
+
+def _invalidate_index_cache():
+    """Force the next dashboard load to recount the tables"""
+    _index_cache['tables_info'] = None
+
+@lru_cache(maxsize=16)
+def _table_meta(table_name):
+    """Return (schema rows, primary key column) for a table, cached until a reset"""
+    conn = get_db_connection()
+    schema = tuple(conn.execute(_TABLE_INFO_SQL[table_name]).fetchall())
+    pk_column = next((col['name'] for col in schema if col['pk']), None)
+    return schema, pk_column
+
+@lru_cache(maxsize=32)
+def _page_sql(table_name, key):
+    """Return the (last key, page rows) queries for a table, keyed by how the page starts"""
+    bounds = {
+        'after': f'{key} > ?',
+        'seek': f'{key} >= (SELECT {key} FROM {table_name} ORDER BY {key} LIMIT 1 OFFSET ?)',
+    }
+    return {
+        name: (f'SELECT {key} FROM {table_name} WHERE {bound} ORDER BY {key} LIMIT 1 OFFSET ?',
+               f'SELECT * FROM {table_name} WHERE {bound} ORDER BY {key} LIMIT ?')
+        for name, bound in bounds.items()
+    }
+
+@lru_cache(maxsize=64)
+def _delete_sql(table_name, pk_column, count):
+    """Return the DELETE statement for a chunk of count primary keys"""
+    return f'DELETE FROM {table_name} WHERE {pk_column} IN ({",".join("?" * count)})'
+
+# Rows deleted per statement, kept under SQLite's bound-parameter limit
+_DELETE_CHUNK_SIZE = 500
+
 @admin_bp.route('/')
 def index():
     """Admin dashboard for database management"""
+    now = time.monotonic()
+    tables_info = _index_cache['tables_info']
+    if tables_info is None or now - _index_cache['time'] >= _INDEX_CACHE_TTL:
+        tables_info = _count_tables()
+        _index_cache.update(time=now, tables_info=tables_info)
+    
+    # Answer 304 when the counts are unchanged
+    etag = hashlib.blake2b(repr(tables_info).encode(), digest_size=8).hexdigest()
+    if not_modified(etag):
+        return cacheable(make_response('', 304), etag)
+    return cacheable(make_response(render_template('admin/index.html', tables_info=tables_info)), etag)
+
+def _count_tables():
+    """Return existence and row count for every admin table"""
     conn = get_db_connection()
     
-    # Get table information
-    tables_info = {}
-    tables = ['customers', 'inventory', 'billing', 'billing_items', 'seller_info', 'purchases']
+    # Plain tuples are enough for these scalar lookups
+    cursor = conn.cursor()
+    cursor.row_factory = None
     
-    for table in tables:
-        try:
-            count = conn.execute(f'SELECT COUNT(*) as count FROM {table}').fetchone()['count']
-            tables_info[table] = {'exists': True, 'count': count}
-        except:
-            tables_info[table] = {'exists': False, 'count': 0}
+    # Find which tables exist, then count all of them in a single query
+    existing = {name for (name,) in cursor.execute(_EXISTING_TABLES_SQL, _TABLES)}
     
-    conn.close()
-    return render_template('admin/index.html', tables_info=tables_info)
+    counts = {}
+    if existing:
+        count_sql = ' UNION ALL '.join(_DASHBOARD_COUNT_SQL[table] for table in _TABLES if table in existing)
+        counts = dict(cursor.execute(count_sql))
+    
+    return {table: {'exists': table in existing, 'count': counts.get(table, 0)} for table in _TABLES}
 
 @admin_bp.route('/seller-info')
 def seller_info():
     """View and manage seller information"""
     conn = get_db_connection()
-    seller = conn.execute('SELECT * FROM seller_info ORDER BY id DESC LIMIT 1').fetchone()
-    conn.close()
+    seller = conn.execute('SELECT * FROM seller_info WHERE id = 1').fetchone()
     return render_template('admin/seller_info.html', seller=seller)
 
 @admin_bp.route('/seller-info/update', methods=['POST'])
@@ -51,27 +125,21 @@ def update_seller_info():
     
     conn = get_db_connection()
     
-    # Check if seller info exists
-    existing = conn.execute('SELECT id FROM seller_info LIMIT 1').fetchone()
-    
-    if existing:
-        # Update existing record
-        conn.execute('''UPDATE seller_info SET seller_name = ?, address = ?, email = ?, mobile = ?,
-                        gst_number = ?, account_name = ?, account_number = ?, ifsc_code = ?,
-                        account_type = ?, branch = ?, updated_at = CURRENT_TIMESTAMP
-                        WHERE id = ?''',
-                    (seller_name, address, email, mobile, gst_number, account_name, account_number,
-                     ifsc_code, account_type, branch, existing['id']))
-    else:
-        # Insert new record
-        conn.execute('''INSERT INTO seller_info (seller_name, address, email, mobile, gst_number,
+    # seller_info is a single row with id 1; insert it or update it in one statement
+    with conn:
+        conn.execute('''INSERT INTO seller_info (id, seller_name, address, email, mobile, gst_number,
                         account_name, account_number, ifsc_code, account_type, branch)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                        VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET
+                            seller_name = excluded.seller_name, address = excluded.address,
+                            email = excluded.email, mobile = excluded.mobile,
+                            gst_number = excluded.gst_number, account_name = excluded.account_name,
+                            account_number = excluded.account_number, ifsc_code = excluded.ifsc_code,
+                            account_type = excluded.account_type, branch = excluded.branch,
+                            updated_at = CURRENT_TIMESTAMP''',
                     (seller_name, address, email, mobile, gst_number, account_name, account_number,
                      ifsc_code, account_type, branch))
-    
-    conn.commit()
-    conn.close()
+    _invalidate_index_cache()
     
     flash('Seller information updated successfully!', 'success')
     return redirect(url_for('admin.seller_info'))
@@ -79,9 +147,7 @@ def update_seller_info():
 @admin_bp.route('/view-table/<table_name>')
 def view_table(table_name):
     """View table data and schema with pagination"""
-    allowed_tables = ['customers', 'inventory', 'billing', 'billing_items', 'seller_info', 'purchases']
-    
-    if table_name not in allowed_tables:
+    if table_name not in _ALLOWED_TABLES:
         flash('Invalid table name!', 'error')
         return redirect(url_for('admin.index'))
     
@@ -96,11 +162,11 @@ def view_table(table_name):
     conn = get_db_connection()
     
     try:
-        # Get table schema
-        schema = conn.execute(f'PRAGMA table_info({table_name})').fetchall()
+        # Get table schema and primary key column
+        schema, pk_column = _table_meta(table_name)
         
         # Get total count
-        total_count = conn.execute(f'SELECT COUNT(*) as count FROM {table_name}').fetchone()['count']
+        total_count = conn.execute(_COUNT_SQL[table_name]).fetchone()[0]
         
         # Calculate pagination
         total_pages = max(1, (total_count + per_page - 1) // per_page) if total_count > 0 else 1
@@ -113,21 +179,29 @@ def view_table(table_name):
         
         offset = (page - 1) * per_page
         
-        # Get paginated data
-        data = conn.execute(f'SELECT * FROM {table_name} LIMIT ? OFFSET ?', (per_page, offset)).fetchall()
+        # Keyset pagination on the primary key: the Next link passes the last key
+        # of this page, so the following page is a direct index seek
+        page_sql = _page_sql(table_name, pk_column or 'rowid')
+        after = request.args.get('after', type=int)
+        if after is not None:
+            last_key_sql, data_sql = page_sql['after']
+            bound_args = (after,)
+        else:
+            # Jumping to a page number: find its first key by walking the key only
+            last_key_sql, data_sql = page_sql['seek']
+            bound_args = (offset,)
         
-        # Get primary key column name
-        pk_column = None
-        for col in schema:
-            if col['pk']:
-                pk_column = col['name']
-                break
+        # Last key on this page, handed to the Next link
+        last_key = conn.execute(last_key_sql, bound_args + (per_page - 1,)).fetchone()
+        
+        # Get paginated data; the template reads rows straight from the cursor
+        data = conn.execute(data_sql, bound_args + (per_page,))
         
         # Calculate pagination info
         has_prev = page > 1
         has_next = page < total_pages
+        next_params = {'after': last_key[0]} if has_next and last_key else {}
         
-        conn.close()
         return render_template('admin/view_table.html',
                              table_name=table_name,
                              schema=schema,
@@ -138,18 +212,16 @@ def view_table(table_name):
                              total_count=total_count,
                              total_pages=total_pages,
                              has_prev=has_prev,
-                             has_next=has_next)
-    except Exception as e:
-        conn.close()
+                             has_next=has_next,
+                             next_params=next_params)
+    except sqlite3.Error as e:
         flash(f'Error viewing table: {str(e)}', 'error')
         return redirect(url_for('admin.index'))
 
 @admin_bp.route('/delete-rows/<table_name>', methods=['POST'])
 def delete_rows(table_name):
     """Delete selected rows from a table"""
-    allowed_tables = ['customers', 'inventory', 'billing', 'billing_items', 'seller_info', 'purchases']
-    
-    if table_name not in allowed_tables:
+    if table_name not in _ALLOWED_TABLES:
         flash('Invalid table name!', 'error')
         return redirect(url_for('admin.index'))
     
@@ -163,27 +235,24 @@ def delete_rows(table_name):
     
     try:
         # Get primary key column name
-        schema = conn.execute(f'PRAGMA table_info({table_name})').fetchall()
-        pk_column = None
-        for col in schema:
-            if col['pk']:
-                pk_column = col['name']
-                break
+        pk_column = _table_meta(table_name)[1]
         
         if not pk_column:
             flash('Table has no primary key!', 'error')
-            conn.close()
             return redirect(url_for('admin.view_table', table_name=table_name))
         
-        # Delete rows
-        placeholders = ','.join('?' * len(row_ids))
-        conn.execute(f'DELETE FROM {table_name} WHERE {pk_column} IN ({placeholders})', row_ids)
+        # Delete rows in fixed-size chunks; the repeated SQL text lets SQLite's
+        # statement cache reuse one prepared DELETE for every full chunk
+        ids = [int(row_id) for row_id in row_ids]
+        conn.execute('BEGIN')
+        for i in range(0, len(ids), _DELETE_CHUNK_SIZE):
+            chunk = ids[i:i + _DELETE_CHUNK_SIZE]
+            conn.execute(_delete_sql(table_name, pk_column, len(chunk)), chunk)
         conn.commit()
-        conn.close()
+        _invalidate_index_cache()
         
         flash(f'{len(row_ids)} row(s) deleted successfully from {table_name}!', 'success')
-    except Exception as e:
-        conn.close()
+    except (ValueError, sqlite3.Error) as e:
         flash(f'Error deleting rows: {str(e)}', 'error')
     
     return redirect(url_for('admin.view_table', table_name=table_name))
@@ -191,156 +260,41 @@ def delete_rows(table_name):
 @admin_bp.route('/reset-table/<table_name>', methods=['POST'])
 def reset_table(table_name):
     """Reset a specific table"""
-    allowed_tables = ['customers', 'inventory', 'billing', 'billing_items', 'seller_info', 'purchases']
+    ddl = _RESET_DDL.get(table_name)
     
-    if table_name not in allowed_tables:
+    if ddl is None:
         flash('Invalid table name!', 'error')
         return redirect(url_for('admin.index'))
     
     conn = get_db_connection()
     
     try:
-        # Drop the table
-        conn.execute(f'DROP TABLE IF EXISTS {table_name}')
-        conn.commit()
-        
-        # Recreate the table with new schema
-        if table_name == 'customers':
-            conn.execute('''
-                CREATE TABLE customers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id TEXT UNIQUE NOT NULL,
-                    vendor_code TEXT UNIQUE,
-                    name TEXT NOT NULL,
-                    email TEXT,
-                    mobile TEXT,
-                    address TEXT,
-                    state TEXT,
-                    gst_number TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        elif table_name == 'inventory':
-            conn.execute('''
-                CREATE TABLE inventory (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    product_id TEXT UNIQUE NOT NULL,
-                    product_name TEXT NOT NULL,
-                    hsn_code TEXT,
-                    manufacture_date DATE,
-                    expiry_month TEXT NOT NULL,
-                    quantity INTEGER NOT NULL DEFAULT 0,
-                    buy_price REAL NOT NULL DEFAULT 0.0,
-                    unit_price REAL NOT NULL DEFAULT 0.0,
-                    mrp REAL NOT NULL DEFAULT 0.0,
-                    gst_percentage REAL NOT NULL DEFAULT 0.0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        elif table_name == 'billing':
-            conn.execute('''
-                CREATE TABLE billing (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    bill_id TEXT UNIQUE NOT NULL,
-                    customer_id INTEGER NOT NULL,
-                    bill_date DATE NOT NULL,
-                    subtotal REAL DEFAULT 0.0,
-                    gst_amount REAL DEFAULT 0.0,
-                    total_amount REAL NOT NULL DEFAULT 0.0,
-                    payment_status TEXT DEFAULT 'Pending',
-                    notes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES customers (id)
-                )
-            ''')
-        elif table_name == 'billing_items':
-            conn.execute('''
-                CREATE TABLE billing_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    bill_id INTEGER NOT NULL,
-                    product_id INTEGER NOT NULL,
-                    product_name TEXT NOT NULL,
-                    quantity INTEGER NOT NULL DEFAULT 1,
-                    unit_price REAL NOT NULL DEFAULT 0.0,
-                    gst_percentage REAL NOT NULL DEFAULT 0.0,
-                    gst_amount REAL NOT NULL DEFAULT 0.0,
-                    cgst REAL NOT NULL DEFAULT 0.0,
-                    sgst REAL NOT NULL DEFAULT 0.0,
-                    igst REAL NOT NULL DEFAULT 0.0,
-                    total REAL NOT NULL DEFAULT 0.0,
-                    FOREIGN KEY (bill_id) REFERENCES billing (id) ON DELETE CASCADE,
-                    FOREIGN KEY (product_id) REFERENCES inventory (id)
-                )
-            ''')
-        elif table_name == 'seller_info':
-            conn.execute('''
-                CREATE TABLE seller_info (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    seller_name TEXT NOT NULL,
-                    address TEXT,
-                    email TEXT,
-                    mobile TEXT,
-                    gst_number TEXT,
-                    account_name TEXT,
-                    account_number TEXT,
-                    ifsc_code TEXT,
-                    account_type TEXT,
-                    branch TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        elif table_name == 'purchases':
-            conn.execute('''
-                CREATE TABLE purchases (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    product_id TEXT NOT NULL,
-                    product_name TEXT NOT NULL,
-                    hsn_code TEXT,
-                    manufacture_date DATE,
-                    expiry_month TEXT NOT NULL,
-                    quantity INTEGER NOT NULL DEFAULT 0,
-                    buy_price REAL NOT NULL DEFAULT 0.0,
-                    unit_price REAL NOT NULL DEFAULT 0.0,
-                    mrp REAL NOT NULL DEFAULT 0.0,
-                    gst_percentage REAL NOT NULL DEFAULT 0.0,
-                    purchase_date DATE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (product_id) REFERENCES inventory (product_id)
-                )
-            ''')
-        
-        conn.commit()
+        # Drop and recreate the table with the current schema in one transaction
+        with conn:
+            conn.executescript(ddl)
+        _table_meta.cache_clear()
+        _invalidate_index_cache()
+        # DROP/CREATE changes no rows, so tell the other caches explicitly
+        bump_data_version()
         flash(f'Table "{table_name}" has been reset successfully!', 'success')
-    except Exception as e:
+    except sqlite3.Error as e:
         flash(f'Error resetting table: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('admin.index'))
 
 @admin_bp.route('/reset-all', methods=['POST'])
 def reset_all():
     """Reset all tables"""
-    conn = get_db_connection()
-    
     try:
-        # Drop all tables
-        conn.execute('DROP TABLE IF EXISTS billing_items')
-        conn.execute('DROP TABLE IF EXISTS billing')
-        conn.execute('DROP TABLE IF EXISTS inventory')
-        conn.execute('DROP TABLE IF EXISTS customers')
-        conn.commit()
-        
-        # Reinitialize database
-        conn.close()
-        init_db()
+        # Drop and recreate the tables in one transaction
+        init_db(drop_tables=['billing_items', 'billing', 'inventory', 'customers'])
+        _table_meta.cache_clear()
+        _invalidate_index_cache()
+        bump_data_version()
         
         flash('All tables have been reset successfully!', 'success')
-    except Exception as e:
+    except sqlite3.Error as e:
         flash(f'Error resetting tables: {str(e)}', 'error')
-        conn.close()
     
     return redirect(url_for('admin.index'))
 
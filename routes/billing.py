@@ -3,12 +3,190 @@ Billing routes module
 Handles all billing-related routes with support for multiple items per bill
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from database import get_db_connection
-from datetime import datetime
+import math
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+from flask import Blueprint, render_template, stream_template, request, redirect, url_for, flash, get_flashed_messages, Response, abort, make_response
+from database import get_db_connection, get_db_connection_fast, data_version, sqlite3
+from routes import not_modified, cacheable
+
+# Prefer orjson for parsing items_data and encoding API responses when it is installed
+try:
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    import json
+    json_loads = json.loads
+    
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
 
 billing_bp = Blueprint('billing', __name__, url_prefix='/billing')
 
+# Largest items_data payload accepted from the bill forms
+MAX_ITEMS_BYTES = 131072
+
+# Numeric fields every bill item must carry before it is written
+ITEM_NUMBER_FIELDS = ('product_id', 'quantity', 'unit_price', 'subtotal', 'gst_percentage', 'gst_amount', 'total')
+
+def _parse_items(items_json):
+    """Decode items_data, returning None when it is not a list of well-formed items"""
+    if len(items_json) > MAX_ITEMS_BYTES:
+        abort(413)
+    try:
+        items = json_loads(items_json)
+    except ValueError:
+        return None
+    if not isinstance(items, list):
+        return None
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('product_name'), str):
+            return None
+        for field in ITEM_NUMBER_FIELDS:
+            value = item.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                return None
+    return items
+
+def _json_response(payload, status=200):
+    """Return payload as a compact JSON response"""
+    return Response(json_dumps(payload), status=status, mimetype='application/json')
+
+def _fetch_dicts(conn, sql, params=()):
+    """Run a query on a plain tuple cursor and build dicts using the column names once"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+# name -> (data_version, value) for lookups that only change when the database does
+_version_cache = {}
+
+def _cached(name, load):
+    """Return load()'s result, reusing it until the next database write"""
+    version = data_version()
+    cached = _version_cache.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    value = load()
+    _version_cache[name] = (version, value)
+    return value
+
+def _form_choices(conn):
+    """Customers and in-stock products with only the fields the bill form's search boxes use"""
+    def load():
+        customers = _fetch_dicts(conn, 'SELECT id, customer_id, name, address FROM customers ORDER BY name')
+        inventory = _fetch_dicts(conn, '''
+            SELECT id, product_id, product_name, hsn_code, manufacture_date, quantity, unit_price, gst_percentage
+            FROM inventory WHERE quantity > 0 ORDER BY product_name
+        ''')
+        return customers, inventory
+    return _cached('form_choices', load)
+
+def _seller(conn):
+    """Seller information (the single seller_info row) as a dict, or None"""
+    def load():
+        rows = _fetch_dicts(conn, 'SELECT * FROM seller_info WHERE id = 1')
+        return rows[0] if rows else None
+    return _cached('seller', load)
+
+def _display_date(value):
+    """Turn an ISO YYYY-MM-DD date into DD-MM-YYYY by slicing"""
+    if value and len(value) == 10:
+        return f'{value[8:10]}-{value[5:7]}-{value[0:4]}'
+    return value
+
+def _quantities_by_product(items):
+    """Sum item quantities per inventory id"""
+    quantities = defaultdict(int)
+    for item in items:
+        quantities[item['product_id']] += item['quantity']
+    return quantities
+
+def _apply_inventory_deltas(conn, deltas):
+    """Apply signed quantity changes {inventory id: delta} in a single UPDATE"""
+    deltas = {pid: delta for pid, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    cases = ' '.join(['WHEN ? THEN quantity + ?'] * len(deltas))
+    placeholders = ','.join('?' * len(deltas))
+    params = [value for pid, delta in deltas.items() for value in (pid, delta)] + list(deltas)
+    conn.execute(f'UPDATE inventory SET quantity = CASE id {cases} ELSE quantity END WHERE id IN ({placeholders})',
+                 params)
+
+def _restore_inventory(conn, bill_internal_ids):
+    """Give back the stock held by the given bills with one aggregated UPDATE"""
+    placeholders = ','.join('?' * len(bill_internal_ids))
+    # Bill items are matched on the TEXT bill_id
+    conn.execute(f'''
+        UPDATE inventory SET quantity = quantity + restored.restore_qty
+        FROM (
+            SELECT bi.product_id, SUM(bi.quantity) as restore_qty
+            FROM billing b
+            JOIN billing_items bi ON bi.bill_id = b.bill_id
+            WHERE b.id IN ({placeholders})
+            GROUP BY bi.product_id
+        ) restored
+        WHERE inventory.id = restored.product_id
+    ''', bill_internal_ids)
+
+# Bill list filters; kept as literal predicates so the planner can match
+# them against indexes, keyed by the show_cancelled flag
+_INDEX_FILTERS = {
+    True: "payment_status = 'Cancelled'",
+    False: "payment_status != 'Cancelled'",
+}
+
+_INDEX_COUNT_SQL = {
+    cancelled: f'SELECT COUNT(*) as count FROM billing WHERE {condition}'
+    for cancelled, condition in _INDEX_FILTERS.items()
+}
+
+# Page the bills first, then count only that page's items in one grouped join
+_INDEX_PAGE_SQL = {
+    cancelled: f'''
+        SELECT p.*, COUNT(bi.id) as item_count
+        FROM (
+            SELECT b.*, c.name as customer_name
+            FROM billing b
+            JOIN customers c ON b.customer_id = c.id
+            WHERE b.{condition}
+            ORDER BY b.created_at DESC
+            LIMIT ? OFFSET ?
+        ) p
+        LEFT JOIN billing_items bi ON bi.bill_id = p.bill_id
+        GROUP BY p.id
+        ORDER BY p.created_at DESC
+    '''
+    for cancelled, condition in _INDEX_FILTERS.items()
+}
+
+# Highest automatic ST### number plus one; matches the idx_billing_st_number partial index
+_NEXT_BILL_NUMBER_SQL = '''
+    SELECT COALESCE(MAX(CAST(SUBSTR(bill_id, 3) AS INTEGER)), 0) + 1
+    FROM billing WHERE bill_id GLOB 'ST[0-9]*'
+'''
+
+def _next_bill_id(conn):
+    """Return the next automatic bill ID (ST###)"""
+    return f'ST{conn.execute(_NEXT_BILL_NUMBER_SQL).fetchone()[0]}'
+
+# Shared by create and update so both reuse one prepared INSERT
+_INSERT_BILL_ITEMS_SQL = '''
+    INSERT INTO billing_items (bill_id, product_id, product_name, hsn_code, quantity,
+                               unit_price, gst_percentage, gst_amount, cgst, sgst, igst, total)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _insert_bill_items(conn, bill_id, items):
+    """Insert a bill's parsed items under its TEXT bill_id"""
+    conn.executemany(_INSERT_BILL_ITEMS_SQL,
+                     [(bill_id, item['product_id'], item['product_name'], item.get('hsn_code', ''),
+                       item['quantity'], item['unit_price'], item['gst_percentage'],
+                       item['gst_amount'], item.get('cgst', 0), item.get('sgst', 0),
+                       item.get('igst', 0), item['total']) for item in items])
+
 @billing_bp.route('/')
 def index():
     """Display all bills with optional filter for cancelled bills and pagination"""
@@ -27,16 +205,7 @@ def index():
     conn = get_db_connection()
     
     # Get total count based on filter
-    if show_cancelled:
-        total_count = conn.execute('''
-            SELECT COUNT(*) as count FROM billing
-            WHERE payment_status = 'Cancelled'
-        ''').fetchone()['count']
-    else:
-        total_count = conn.execute('''
-            SELECT COUNT(*) as count FROM billing
-            WHERE payment_status != 'Cancelled'
-        ''').fetchone()['count']
+    total_count = conn.execute(_INDEX_COUNT_SQL[show_cancelled]).fetchone()['count']
     
     # Calculate pagination info
     total_pages = max(1, (total_count + per_page - 1) // per_page) if total_count > 0 else 1
@@ -48,35 +217,18 @@ def index():
     # Calculate offset
     offset = (page - 1) * per_page
     
-    if show_cancelled:
-        # Show only cancelled bills
-        bills = conn.execute('''
-            SELECT b.*, c.name as customer_name,
-                   (SELECT COUNT(*) FROM billing_items WHERE bill_id = b.bill_id) as item_count
-            FROM billing b
-            JOIN customers c ON b.customer_id = c.id
-            WHERE b.payment_status = 'Cancelled'
-            ORDER BY b.created_at DESC
-            LIMIT ? OFFSET ?
-        ''', (per_page, offset)).fetchall()
-    else:
-        # Show all bills except cancelled
-        bills = conn.execute('''
-            SELECT b.*, c.name as customer_name,
-                   (SELECT COUNT(*) FROM billing_items WHERE bill_id = b.bill_id) as item_count
-            FROM billing b
-            JOIN customers c ON b.customer_id = c.id
-            WHERE b.payment_status != 'Cancelled'
-            ORDER BY b.created_at DESC
-            LIMIT ? OFFSET ?
-        ''', (per_page, offset)).fetchall()
-    
-    conn.close()
+    # Show only cancelled bills, or all bills except cancelled
+    bills = conn.execute(_INDEX_PAGE_SQL[show_cancelled], (per_page, offset))
     
     has_prev = page > 1
     has_next = page < total_pages
     
-    return render_template('billing/index.html',
+    # Read flashed messages now so the session is updated before the
+    # response headers go out; the template then reuses the cached list
+    get_flashed_messages()
+    
+    # Stream the page so rows are rendered straight from the cursor
+    return Response(stream_template('billing/index.html',
                          bills=bills,
                          show_cancelled=show_cancelled,
                          page=page,
@@ -84,23 +236,24 @@ def index():
                          total_count=total_count,
                          total_pages=total_pages,
                          has_prev=has_prev,
-                         has_next=has_next)
+                         has_next=has_next))
 
 @billing_bp.route('/create', methods=['GET', 'POST'])
 def create():
     """Create a new bill with multiple items"""
+    # The empty form only changes when the database does
+    etag = f'bill-form-{data_version()}'
+    if request.method == 'GET' and not_modified(etag):
+        return cacheable(make_response('', 304), etag)
+    
     conn = get_db_connection()
     
     # Get seller information for state comparison
-    seller = conn.execute('SELECT state FROM seller_info ORDER BY id DESC LIMIT 1').fetchone()
+    seller = _seller(conn)
     seller_state = seller['state'] if seller and seller['state'] else ''
     
     # Get customers and inventory for form
-    customers_rows = conn.execute('SELECT * FROM customers ORDER BY name').fetchall()
-    customers = [dict(row) for row in customers_rows]
-    
-    inventory_rows = conn.execute('SELECT * FROM inventory WHERE quantity > 0 ORDER BY product_name').fetchall()
-    inventory = [dict(row) for row in inventory_rows]
+    customers, inventory = _form_choices(conn)
     
     if request.method == 'POST':
         bill_id = request.form.get('bill_id', '').strip()
@@ -111,23 +264,14 @@ def create():
         notes = request.form.get('notes', '')
         
         # Handle bill_id generation
-        if bill_id_mode == 'auto' or not bill_id:
-            # Auto-generate bill_id in format ST###
-            last_bill = conn.execute('SELECT bill_id FROM billing ORDER BY id DESC LIMIT 1').fetchone()
-            if last_bill and last_bill['bill_id']:
-                # Extract number from last bill_id (e.g., ST486 -> 486)
-                try:
-                    last_num = int(last_bill['bill_id'][2:])  # Skip 'ST' prefix
-                    next_num = last_num + 1
-                except (ValueError, IndexError):
-                    next_num = 1
-            else:
-                next_num = 1
-            bill_id = f'ST{next_num}'
+        auto_bill_id = bill_id_mode == 'auto' or not bill_id
+        if auto_bill_id:
+            # Auto-generate bill_id in format ST### (reallocated inside the write transaction)
+            bill_id = _next_bill_id(conn)
         else:
             # Manual mode - validate uniqueness
-            existing = conn.execute('SELECT id FROM billing WHERE bill_id = ?', (bill_id,)).fetchone()
-            if existing:
+            exists = conn.execute('SELECT 1 FROM billing WHERE bill_id = ? LIMIT 1', (bill_id,)).fetchone() is not None
+            if exists:
                 flash(f'Bill ID "{bill_id}" already exists! Please use a different ID.', 'error')
                 # Return to form with existing data
                 form_data = {
@@ -138,13 +282,23 @@ def create():
                     'notes': notes,
                     'items_data': request.form.get('items_data', '[]')
                 }
-                conn.close()
                 return render_template('billing/create.html', customers=customers, inventory=inventory, form_data=form_data)
         
         # Get items data (sent as JSON)
-        import json
         items_json = request.form.get('items_data', '[]')
-        items = json.loads(items_json)
+        items = _parse_items(items_json)
+        
+        if items is None:
+            flash('Invalid bill items data!', 'error')
+            form_data = {
+                'bill_id': bill_id,
+                'customer_id': customer_id,
+                'bill_date': bill_date,
+                'payment_status': payment_status,
+                'notes': notes,
+                'items_data': '[]'
+            }
+            return render_template('billing/create.html', customers=customers, inventory=inventory, form_data=form_data)
         
         if not customer_id or not bill_date:
             flash('Customer and Bill Date are required!', 'error')
@@ -157,7 +311,6 @@ def create():
                 'notes': notes,
                 'items_data': items_json
             }
-            conn.close()
             return render_template('billing/create.html', customers=customers, inventory=inventory, form_data=form_data)
         
         if not items or len(items) == 0:
@@ -171,28 +324,26 @@ def create():
                 'notes': notes,
                 'items_data': items_json
             }
-            conn.close()
             return render_template('billing/create.html', customers=customers, inventory=inventory, form_data=form_data)
         
         # Group items by product_id and sum quantities for duplicate products
-        product_quantities = {}
+        product_quantities = defaultdict(int)
+        product_names = {}
         for item in items:
             product_id = item['product_id']
-            if product_id in product_quantities:
-                product_quantities[product_id]['total_quantity'] += item['quantity']
-            else:
-                product_quantities[product_id] = {
-                    'total_quantity': item['quantity'],
-                    'product_name': item['product_name']
-                }
-        
-        # Check inventory for all products (considering total quantities)
-        for product_id, data in product_quantities.items():
-            product = conn.execute('SELECT product_id, product_name, quantity FROM inventory WHERE id = ?',
-                                 (product_id,)).fetchone()
+            product_quantities[product_id] += item['quantity']
+            product_names.setdefault(product_id, item['product_name'])
+        
+        # Check inventory for all products in one query (considering total quantities)
+        placeholders = ','.join('?' * len(product_quantities))
+        stock = {row['id']: row for row in conn.execute(
+            f'SELECT id, product_id, product_name, quantity FROM inventory WHERE id IN ({placeholders})',
+            list(product_quantities)).fetchall()}
+        for product_id, total_quantity in product_quantities.items():
+            product = stock.get(product_id)
             if product:
-                if product['quantity'] < data['total_quantity']:
-                    flash(f'Insufficient quantity for {product["product_name"]} (Product ID: {product["product_id"]}). Requested: {data["total_quantity"]}, Available: {product["quantity"]}', 'error')
+                if product['quantity'] < total_quantity:
+                    flash(f'Insufficient quantity for {product["product_name"]} (Product ID: {product["product_id"]}). Requested: {total_quantity}, Available: {product["quantity"]}', 'error')
                     # Return to form with existing data
                     form_data = {
                         'bill_id': bill_id,
@@ -202,10 +353,9 @@ def create():
                         'notes': notes,
                         'items_data': items_json
                     }
-                    conn.close()
                     return render_template('billing/create.html', customers=customers, inventory=inventory, form_data=form_data)
             else:
-                flash(f'Product {data["product_name"]} not found in inventory!', 'error')
+                flash(f'Product {product_names[product_id]} not found in inventory!', 'error')
                 # Return to form with existing data
                 form_data = {
                     'bill_id': bill_id,
@@ -215,16 +365,16 @@ def create():
                     'notes': notes,
                     'items_data': items_json
                 }
-                conn.close()
                 return render_template('billing/create.html', customers=customers, inventory=inventory, form_data=form_data)
         
-        # Calculate totals
-        subtotal = sum(float(item['subtotal']) for item in items)
-        gst_amount = sum(float(item['gst_amount']) for item in items)
-        total_before_round = sum(float(item['total']) for item in items)
+        # Calculate totals in a single pass (parsed JSON numbers are already int/float)
+        subtotal = gst_amount = total_before_round = 0.0
+        for item in items:
+            subtotal += item['subtotal']
+            gst_amount += item['gst_amount']
+            total_before_round += item['total']
         
         # Calculate round-off: if decimal >= 0.55, round up (+1), else round down (-1)
-        import math
         decimal_part = total_before_round - math.floor(total_before_round)
         if decimal_part >= 0.55:
             rounded_total = math.ceil(total_before_round)
@@ -235,68 +385,78 @@ def create():
         
         total_amount = rounded_total
         
-        # Insert bill header
-        cursor = conn.execute('''INSERT INTO billing (bill_id, customer_id, bill_date, subtotal, gst_amount,
-                                round_off, total_amount, payment_status, notes)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                            (bill_id, customer_id, bill_date, subtotal, gst_amount, round_off,
-                             total_amount, payment_status, notes))
-        
-        # Get the auto-generated numeric ID for the bill
-        new_bill_numeric_id = cursor.lastrowid
-        
-        # Insert bill items and update inventory (use TEXT bill_id, not numeric ID)
-        for item in items:
-            conn.execute('''INSERT INTO billing_items (bill_id, product_id, product_name, hsn_code, quantity,
-                           unit_price, gst_percentage, gst_amount, cgst, sgst, igst, total)
-                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                        (bill_id, item['product_id'], item['product_name'], item.get('hsn_code', ''),
-                         item['quantity'], item['unit_price'], item['gst_percentage'],
-                         item['gst_amount'], item.get('cgst', 0), item.get('sgst', 0),
-                         item.get('igst', 0), item['total']))
+        # Write the header, items and stock changes in one transaction
+        try:
+            conn.execute('BEGIN IMMEDIATE')
             
-            # Reduce inventory
-            conn.execute('UPDATE inventory SET quantity = quantity - ? WHERE id = ?',
-                        (item['quantity'], item['product_id']))
-        
-        conn.commit()
-        conn.close()
+            # Take the next number while holding the write lock so concurrent bills can't share it
+            if auto_bill_id:
+                bill_id = _next_bill_id(conn)
+            
+            # Insert bill header
+            conn.execute('''INSERT INTO billing (bill_id, customer_id, bill_date, subtotal, gst_amount,
+                                    round_off, total_amount, payment_status, notes)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                (bill_id, customer_id, bill_date, subtotal, gst_amount, round_off,
+                                 total_amount, payment_status, notes))
+            
+            # Insert bill items (use TEXT bill_id, not numeric ID) and reduce inventory
+            _insert_bill_items(conn, bill_id, items)
+            _apply_inventory_deltas(conn, {pid: -qty for pid, qty in product_quantities.items()})
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            flash(f'Error creating bill: {str(e)}', 'error')
+            form_data = {
+                'bill_id': bill_id,
+                'customer_id': customer_id,
+                'bill_date': bill_date,
+                'payment_status': payment_status,
+                'notes': notes,
+                'items_data': items_json
+            }
+            return render_template('billing/create.html', customers=customers, inventory=inventory, form_data=form_data)
         
         flash(f'Bill {bill_id} created successfully with {len(items)} item(s)! Inventory updated.', 'success')
         return redirect(url_for('billing.index'))
     
     # GET request - show empty form
-    conn.close()
-    return render_template('billing/create.html', customers=customers, inventory=inventory,
-                         form_data=None, seller_state=seller_state)
+    return cacheable(make_response(render_template('billing/create.html', customers=customers, inventory=inventory,
+                                                    form_data=None, seller_state=seller_state)), etag)
 
 @billing_bp.route('/api/customer/<int:customer_id>')
 def get_customer(customer_id):
     """API endpoint to get customer details"""
+    etag = f'customer-{customer_id}-{data_version()}'
+    if not_modified(etag):
+        return cacheable(make_response('', 304), etag)
+    
     conn = get_db_connection()
     customer = conn.execute('SELECT * FROM customers WHERE id = ?', (customer_id,)).fetchone()
-    conn.close()
     
     if customer:
-        return jsonify({
+        return cacheable(_json_response({
             'id': customer['id'],
             'customer_id': customer['customer_id'],
             'name': customer['name'],
             'vendor_code': customer['vendor_code'],
             'state': customer['state'],
             'address': customer['address']
-        })
-    return jsonify({'error': 'Customer not found'}), 404
+        }), etag)
+    return _json_response({'error': 'Customer not found'}, 404)
 
 @billing_bp.route('/api/product/<int:product_id>')
 def get_product(product_id):
     """API endpoint to get product details"""
+    etag = f'product-{product_id}-{data_version()}'
+    if not_modified(etag):
+        return cacheable(make_response('', 304), etag)
+    
     conn = get_db_connection()
     product = conn.execute('SELECT * FROM inventory WHERE id = ?', (product_id,)).fetchone()
-    conn.close()
     
     if product:
-        return jsonify({
+        return cacheable(_json_response({
             'id': product['id'],
             'product_id': product['product_id'],
             'product_name': product['product_name'],
@@ -307,8 +467,8 @@ def get_product(product_id):
             'unit_price': product['unit_price'],
             'mrp': product['mrp'],
             'gst_percentage': product['gst_percentage']
-        })
-    return jsonify({'error': 'Product not found'}), 404
+        }), etag)
+    return _json_response({'error': 'Product not found'}, 404)
 
 @billing_bp.route('/delete/<int:id>')
 def delete(id):
@@ -316,27 +476,17 @@ def delete(id):
     conn = get_db_connection()
     
     # Get bill_id text from billing table
-    bill = conn.execute('SELECT bill_id FROM billing WHERE id = ?', (id,)).fetchone()
+    bill = conn.execute('SELECT 1 FROM billing WHERE id = ?', (id,)).fetchone()
     if not bill:
         flash('Bill not found!', 'error')
-        conn.close()
         return redirect(url_for('billing.index'))
     
-    bill_id_text = bill['bill_id']
-    
-    # Get bill items to restore inventory
-    items = conn.execute('SELECT product_id, quantity FROM billing_items WHERE bill_id = ?', (bill_id_text,)).fetchall()
-    
-    for item in items:
-        # Restore inventory quantity
-        conn.execute('UPDATE inventory SET quantity = quantity + ? WHERE id = ?',
-                    (item['quantity'], item['product_id']))
-    
-    # Delete bill items and bill
-    conn.execute('DELETE FROM billing_items WHERE bill_id = ?', (bill_id_text,))
+    # Restore inventory and delete the bill in one transaction
+    # (trg_billing_delete_items removes its items)
+    conn.execute('BEGIN IMMEDIATE')
+    _restore_inventory(conn, [id])
     conn.execute('DELETE FROM billing WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
     
     flash('Bill deleted successfully! Inventory restored.', 'success')
     return redirect(url_for('billing.index'))
@@ -361,47 +511,29 @@ def cancel_bills_confirm():
         WHERE b.id IN ({placeholders})
     ''', bill_internal_ids).fetchall()
     
-    # Calculate inventory changes for all selected bills
-    inventory_changes = []
-    product_totals = {}
-    
-    for bill in bills:
-        # Use TEXT bill_id (like "ST123") not numeric id
-        bill_id_text = bill['bill_id']
-        items = conn.execute('''
-            SELECT product_id, product_name, quantity
-            FROM billing_items
-            WHERE bill_id = ?
-        ''', (bill_id_text,)).fetchall()
-        
-        for item in items:
-            pid = item['product_id']
-            if pid in product_totals:
-                product_totals[pid]['quantity'] += item['quantity']
-            else:
-                product_totals[pid] = {
-                    'product_name': item['product_name'],
-                    'quantity': item['quantity']
-                }
-    
-    # Get current inventory and calculate changes
-    for pid, data in product_totals.items():
-        current_inv = conn.execute('SELECT quantity FROM inventory WHERE id = ?', (pid,)).fetchone()
-        current_qty = current_inv['quantity'] if current_inv else 0
-        new_qty = current_qty + data['quantity']
-        
-        inventory_changes.append({
-            'product_id': pid,
-            'product_name': data['product_name'],
-            'current_qty': current_qty,
-            'restore_qty': data['quantity'],
-            'new_qty': new_qty
-        })
-    
-    conn.close()
+    # Total the restored quantity per product across all selected bills, with
+    # current stock alongside (items use the TEXT bill_id like "ST123")
+    totals = conn.execute(f'''
+        SELECT bi.product_id, bi.product_name, SUM(bi.quantity) as restore_qty,
+               COALESCE(i.quantity, 0) as current_qty
+        FROM billing b
+        JOIN billing_items bi ON bi.bill_id = b.bill_id
+        LEFT JOIN inventory i ON i.id = bi.product_id
+        WHERE b.id IN ({placeholders})
+        GROUP BY bi.product_id
+        ORDER BY MIN(bi.id)
+    ''', bill_internal_ids)
+    
+    inventory_changes = [{
+        'product_id': row['product_id'],
+        'product_name': row['product_name'],
+        'current_qty': row['current_qty'],
+        'restore_qty': row['restore_qty'],
+        'new_qty': row['current_qty'] + row['restore_qty']
+    } for row in totals]
     
     return render_template('billing/cancel_confirm.html',
-                         bills=[dict(b) for b in bills],
+                         bills=bills,
                          bill_ids=bill_internal_ids,
                          inventory_changes=inventory_changes)
 
@@ -416,27 +548,16 @@ def cancel_bills():
     
     conn = get_db_connection()
     
+    placeholders = ','.join('?' * len(bill_internal_ids))
+    conn.execute('BEGIN IMMEDIATE')
+    
     # Restore inventory for all bills being cancelled
-    for bill_internal_id in bill_internal_ids:
-        # Get bill_id text from billing table
-        bill = conn.execute('SELECT bill_id FROM billing WHERE id = ?', (bill_internal_id,)).fetchone()
-        if bill:
-            bill_id_text = bill['bill_id']
-            
-            # Get bill items using TEXT bill_id
-            items = conn.execute('SELECT product_id, quantity FROM billing_items WHERE bill_id = ?',
-                               (bill_id_text,)).fetchall()
-            
-            for item in items:
-                conn.execute('UPDATE inventory SET quantity = quantity + ? WHERE id = ?',
-                            (item['quantity'], item['product_id']))
+    _restore_inventory(conn, bill_internal_ids)
     
     # Update bills to Cancelled status
-    placeholders = ','.join('?' * len(bill_internal_ids))
     conn.execute(f'UPDATE billing SET payment_status = ? WHERE id IN ({placeholders})',
                 ['Cancelled'] + bill_internal_ids)
     conn.commit()
-    conn.close()
     
     flash(f'{len(bill_internal_ids)} bill(s) cancelled successfully! Inventory restored.', 'success')
     return redirect(url_for('billing.index'))
@@ -452,103 +573,66 @@ def delete_multiple():
     
     conn = get_db_connection()
     
-    # Get bill_id texts for the selected bills
+    # Restore inventory for all bills being deleted, then delete the bills
+    # (trg_billing_delete_items removes their items)
     placeholders = ','.join('?' * len(bill_internal_ids))
-    bills = conn.execute(f'SELECT bill_id FROM billing WHERE id IN ({placeholders})', bill_internal_ids).fetchall()
-    bill_id_texts = [bill['bill_id'] for bill in bills]
-    
-    # Restore inventory for all bills being deleted
-    placeholders_text = ','.join('?' * len(bill_id_texts))
-    items = conn.execute(f'SELECT product_id, quantity FROM billing_items WHERE bill_id IN ({placeholders_text})',
-                        bill_id_texts).fetchall()
-    
-    for item in items:
-        conn.execute('UPDATE inventory SET quantity = quantity + ? WHERE id = ?',
-                    (item['quantity'], item['product_id']))
-    
-    # Delete bill items and bills
-    conn.execute(f'DELETE FROM billing_items WHERE bill_id IN ({placeholders_text})', bill_id_texts)
-    placeholders_int = ','.join('?' * len(bill_internal_ids))
-    conn.execute(f'DELETE FROM billing WHERE id IN ({placeholders_int})', bill_internal_ids)
+    conn.execute('BEGIN IMMEDIATE')
+    _restore_inventory(conn, bill_internal_ids)
+    conn.execute(f'DELETE FROM billing WHERE id IN ({placeholders})', bill_internal_ids)
     conn.commit()
-    conn.close()
     
     flash(f'{len(bill_internal_ids)} bill(s) deleted successfully! Inventory restored.', 'success')
     return redirect(url_for('billing.index'))
 
-@billing_bp.route('/view/<int:id>')
-def view(id):
-    """View bill details with all items"""
+# One bill with its customer details and items (as a JSON array), for view and print
+_BILL_WITH_ITEMS_SQL = '''
+    SELECT b.*, c.name as customer_name, c.email, c.mobile, c.address, c.gst_number,
+           (SELECT json_group_array(json_object(
+                       'id', it.id, 'bill_id', it.bill_id, 'product_id', it.product_id,
+                       'product_name', it.product_name, 'hsn_code', it.hsn_code,
+                       'quantity', it.quantity, 'unit_price', it.unit_price,
+                       'gst_percentage', it.gst_percentage, 'gst_amount', it.gst_amount,
+                       'cgst', it.cgst, 'sgst', it.sgst, 'igst', it.igst, 'total', it.total,
+                       'inventory_product_id', it.inventory_product_id))
+            FROM (SELECT bi.*, i.product_id as inventory_product_id
+                  FROM billing_items bi
+                  LEFT JOIN inventory i ON bi.product_id = i.id
+                  WHERE bi.bill_id = b.bill_id
+                  ORDER BY bi.id) it) as items_json
+    FROM billing b
+    JOIN customers c ON b.customer_id = c.id
+    WHERE b.id = ?
+'''
+
+def _render_bill(id, template):
+    """Render a single bill with its items and the seller details"""
     conn = get_db_connection()
-    bill = conn.execute('''
-        SELECT b.*, c.name as customer_name, c.email, c.mobile, c.address, c.gst_number
-        FROM billing b
-        JOIN customers c ON b.customer_id = c.id
-        WHERE b.id = ?
-    ''', (id,)).fetchone()
+    bill = conn.execute(_BILL_WITH_ITEMS_SQL, (id,)).fetchone()
     
     if not bill:
         flash('Bill not found!', 'error')
-        conn.close()
         return redirect(url_for('billing.index'))
     
-    # Convert bill to dict and format date
+    # Convert bill to dict and format date (YYYY-MM-DD to DD-MM-YYYY)
     bill_dict = dict(bill)
-    if bill_dict['bill_date']:
-        # Convert YYYY-MM-DD to DD-MM-YYYY
-        date_obj = datetime.strptime(bill_dict['bill_date'], '%Y-%m-%d')
-        bill_dict['bill_date'] = date_obj.strftime('%d-%m-%Y')
-    
-    items = conn.execute('''
-        SELECT bi.*, i.product_id as inventory_product_id
-        FROM billing_items bi
-        LEFT JOIN inventory i ON bi.product_id = i.id
-        WHERE bi.bill_id = ?
-        ORDER BY bi.id
-    ''', (bill_dict['bill_id'],)).fetchall()
+    items = json_loads(bill_dict.pop('items_json'))
+    bill_dict['bill_date'] = _display_date(bill_dict['bill_date'])
     
     # Get seller information
-    seller = conn.execute('SELECT * FROM seller_info ORDER BY id DESC LIMIT 1').fetchone()
+    seller = _seller(conn)
     
-    conn.close()
-    return render_template('billing/view.html', bill=bill_dict, items=items, seller=seller)
+    return render_template(template, bill=bill_dict, items=items, seller=seller)
+
+@billing_bp.route('/view/<int:id>')
+def view(id):
+    """View bill details with all items"""
+    return _render_bill(id, 'billing/view.html')
 
 @billing_bp.route('/print/<int:id>')
 def print_bill(id):
     """Print-friendly view of bill details"""
-    conn = get_db_connection()
-    bill = conn.execute('''
-        SELECT b.*, c.name as customer_name, c.email, c.mobile, c.address, c.gst_number
-        FROM billing b
-        JOIN customers c ON b.customer_id = c.id
-        WHERE b.id = ?
-    ''', (id,)).fetchone()
-    
-    if not bill:
-        flash('Bill not found!', 'error')
-        conn.close()
-        return redirect(url_for('billing.index'))
-    
-    # Convert bill to dict and format date
-    bill_dict = dict(bill)
-    if bill_dict['bill_date']:
-        # Convert YYYY-MM-DD to DD-MM-YYYY
-        date_obj = datetime.strptime(bill_dict['bill_date'], '%Y-%m-%d')
-        bill_dict['bill_date'] = date_obj.strftime('%d-%m-%Y')
-    
-    items = conn.execute('''
-        SELECT bi.*, i.product_id as inventory_product_id
-        FROM billing_items bi
-        LEFT JOIN inventory i ON bi.product_id = i.id
-        WHERE bi.bill_id = ?
-        ORDER BY bi.id
-    ''', (bill_dict['bill_id'],)).fetchall()
-    
-    # Get seller information
-    seller = conn.execute('SELECT * FROM seller_info ORDER BY id DESC LIMIT 1').fetchone()
-    
-    conn.close()
-    return render_template('billing/print.html', bill=bill_dict, items=items, seller=seller)
+    return _render_bill(id, 'billing/print.html')
+
 @billing_bp.route('/print-multiple')
 def print_multiple():
     """Print multiple bills in a single printable page"""
@@ -572,46 +656,49 @@ def print_multiple():
     conn = get_db_connection()
     
     # Get seller information (same for all bills)
-    seller = conn.execute('SELECT * FROM seller_info ORDER BY id DESC LIMIT 1').fetchone()
+    seller = _seller(conn)
     
-    # Collect all bills data
+    # Get all selected bills in one query
+    placeholders = ','.join('?' * len(bill_ids))
+    bills = {bill['id']: bill for bill in conn.execute(f'''
+        SELECT b.*, c.name as customer_name, c.email, c.mobile, c.address, c.gst_number
+        FROM billing b
+        JOIN customers c ON b.customer_id = c.id
+        WHERE b.id IN ({placeholders})
+    ''', bill_ids)}
+    
+    # Get the items of all those bills in one query, grouped by billing.id; the
+    # item's own bill_id comes back as an int for numeric bill numbers like '123'
+    items_by_bill = {id: [] for id in bills}
+    if items_by_bill:
+        placeholders = ','.join('?' * len(items_by_bill))
+        for item in conn.execute(f'''
+            SELECT bi.*, i.product_id as inventory_product_id, b.id as bill_row_id
+            FROM billing b
+            JOIN billing_items bi ON bi.bill_id = b.bill_id
+            LEFT JOIN inventory i ON bi.product_id = i.id
+            WHERE b.id IN ({placeholders})
+            ORDER BY bi.id
+        ''', list(items_by_bill)):
+            items_by_bill[item['bill_row_id']].append(item)
+    
+    # Collect all bills data in the order they were requested
     bills_data = []
     
     for bill_id in bill_ids:
-        # Get bill details
-        bill = conn.execute('''
-            SELECT b.*, c.name as customer_name, c.email, c.mobile, c.address, c.gst_number
-            FROM billing b
-            JOIN customers c ON b.customer_id = c.id
-            WHERE b.id = ?
-        ''', (bill_id,)).fetchone()
-        
+        bill = bills.get(bill_id)
         if not bill:
             continue
         
-        # Convert bill to dict and format date
+        # Convert bill to dict and format date (YYYY-MM-DD to DD-MM-YYYY)
         bill_dict = dict(bill)
-        if bill_dict['bill_date']:
-            # Convert YYYY-MM-DD to DD-MM-YYYY
-            date_obj = datetime.strptime(bill_dict['bill_date'], '%Y-%m-%d')
-            bill_dict['bill_date'] = date_obj.strftime('%d-%m-%Y')
-        
-        # Get bill items
-        items = conn.execute('''
-            SELECT bi.*, i.product_id as inventory_product_id
-            FROM billing_items bi
-            LEFT JOIN inventory i ON bi.product_id = i.id
-            WHERE bi.bill_id = ?
-            ORDER BY bi.id
-        ''', (bill_id,)).fetchall()
+        bill_dict['bill_date'] = _display_date(bill_dict['bill_date'])
         
         bills_data.append({
             'bill': bill_dict,
-            'items': items
+            'items': items_by_bill[bill_id]
         })
     
-    conn.close()
-    
     if not bills_data:
         flash('No valid bills found for printing!', 'error')
         return redirect(url_for('billing.index'))
@@ -625,7 +712,7 @@ def update(bill_id):
     conn = get_db_connection()
     
     # Get seller information for state comparison
-    seller = conn.execute('SELECT state FROM seller_info ORDER BY id DESC LIMIT 1').fetchone()
+    seller = _seller(conn)
     seller_state = seller['state'] if seller and seller['state'] else ''
     
     if request.method == 'POST':
@@ -641,74 +728,67 @@ def update(bill_id):
         # Validate bill_id uniqueness (if changed)
         current_bill = conn.execute('SELECT bill_id FROM billing WHERE id = ?', (bill_id,)).fetchone()
         if new_bill_id != current_bill['bill_id']:
-            existing = conn.execute('SELECT id FROM billing WHERE bill_id = ? AND id != ?',
-                                   (new_bill_id, bill_id)).fetchone()
-            if existing:
+            exists = conn.execute('SELECT 1 FROM billing WHERE bill_id = ? AND id != ? LIMIT 1',
+                                 (new_bill_id, bill_id)).fetchone() is not None
+            if exists:
                 flash(f'Bill ID "{new_bill_id}" already exists! Please use a different ID.', 'error')
-                conn.close()
                 return redirect(url_for('billing.update', bill_id=bill_id))
         
         # Get items data (sent as JSON)
-        import json
         items_json = request.form.get('items_data', '[]')
-        items = json.loads(items_json)
+        items = _parse_items(items_json)
+        
+        if items is None:
+            flash('Invalid bill items data!', 'error')
+            return redirect(url_for('billing.update', bill_id=bill_id))
         
         if not customer_id or not bill_date:
             flash('Customer and Bill Date are required!', 'error')
-            conn.close()
             return redirect(url_for('billing.update', bill_id=bill_id))
         
         if not items or len(items) == 0:
             flash('Please add at least one item to the bill!', 'error')
-            conn.close()
             return redirect(url_for('billing.update', bill_id=bill_id))
         
         # Get current bill's bill_id text
         current_bill_id_text = current_bill['bill_id']
         
-        # Get old bill items (use numeric bill_id, not text bill_id)
-        old_items = conn.execute('SELECT product_id, quantity, product_name FROM billing_items WHERE bill_id = ?',
-                                (bill_id,)).fetchall()
-        
         # If not confirmed, show preview of inventory changes
         if confirm_update != 'yes':
+            # Get old bill items (use TEXT bill_id, not numeric ID)
+            old_items = conn.execute('SELECT product_id, quantity, product_name FROM billing_items WHERE bill_id = ?',
+                                    (current_bill_id_text,)).fetchall()
+            
             # Calculate inventory changes
             inventory_changes = []
             
             # Track old items (will be restored)
-            old_products = {}
+            old_products = defaultdict(int)
+            product_names = {}
             for old_item in old_items:
                 pid = old_item['product_id']
-                if pid in old_products:
-                    old_products[pid]['quantity'] += old_item['quantity']
-                else:
-                    old_products[pid] = {
-                        'product_name': old_item['product_name'],
-                        'quantity': old_item['quantity']
-                    }
+                old_products[pid] += old_item['quantity']
+                product_names.setdefault(pid, old_item['product_name'])
             
             # Track new items (will be deducted)
-            new_products = {}
+            new_products = defaultdict(int)
             for item in items:
                 pid = item['product_id']
-                if pid in new_products:
-                    new_products[pid]['quantity'] += item['quantity']
-                else:
-                    new_products[pid] = {
-                        'product_name': item['product_name'],
-                        'quantity': item['quantity']
-                    }
+                new_products[pid] += item['quantity']
+                product_names.setdefault(pid, item['product_name'])
+            
+            # Get current inventory for every product involved in one query
+            all_product_ids = list(old_products.keys() | new_products.keys())
+            placeholders = ','.join('?' * len(all_product_ids))
+            current_stock = dict(conn.execute(f'SELECT id, quantity FROM inventory WHERE id IN ({placeholders})',
+                                              all_product_ids).fetchall())
             
             # Calculate net changes
-            all_product_ids = set(old_products.keys()) | set(new_products.keys())
             for pid in all_product_ids:
-                old_qty = old_products.get(pid, {}).get('quantity', 0)
-                new_qty = new_products.get(pid, {}).get('quantity', 0)
-                product_name = old_products.get(pid, {}).get('product_name') or new_products.get(pid, {}).get('product_name')
-                
-                # Get current inventory
-                current_inv = conn.execute('SELECT quantity FROM inventory WHERE id = ?', (pid,)).fetchone()
-                current_qty = current_inv['quantity'] if current_inv else 0
+                old_qty = old_products.get(pid, 0)
+                new_qty = new_products.get(pid, 0)
+                product_name = product_names[pid]
+                current_qty = current_stock.get(pid, 0)
                 
                 net_change = old_qty - new_qty  # Positive means inventory increases, negative means decreases
                 new_inventory = current_qty + net_change
@@ -734,24 +814,15 @@ def update(bill_id):
                 flash('Cannot update bill: Insufficient inventory for the following products:', 'error')
                 for item in insufficient_stock:
                     flash(f"• {item['product_name']}: Current stock {item['current_qty']}, would become {item['new_inventory']} after update", 'error')
-                conn.close()
                 return redirect(url_for('billing.update', bill_id=bill_id))
             
             # Get all data for the confirmation form
             bill = conn.execute('SELECT * FROM billing WHERE id = ?', (bill_id,)).fetchone()
-            customers_rows = conn.execute('SELECT * FROM customers ORDER BY name').fetchall()
-            customers = [dict(row) for row in customers_rows]
-            inventory_rows = conn.execute('SELECT * FROM inventory ORDER BY product_name').fetchall()
-            inventory = [dict(row) for row in inventory_rows]
-            
-            conn.close()
             
             # Show confirmation page with inventory changes
             return render_template('billing/update_confirm.html',
-                                 bill=dict(bill),
+                                 bill=bill,
                                  items=items,
-                                 customers=customers,
-                                 inventory=inventory,
                                  inventory_changes=inventory_changes,
                                  form_data={
                                      'bill_id': new_bill_id,
@@ -762,100 +833,68 @@ def update(bill_id):
                                      'items_data': items_json
                                  })
         
-        # User confirmed - proceed with update
-        # Restore old inventory quantities
-        for old_item in old_items:
-            conn.execute('UPDATE inventory SET quantity = quantity + ? WHERE id = ?',
-                        (old_item['quantity'], old_item['product_id']))
+        # User confirmed - proceed with update in one transaction
+        conn.execute('BEGIN IMMEDIATE')
+        
+        # Remove the old bill items, reading back what they held; a rollback below puts them back
+        old_items = conn.execute('DELETE FROM billing_items WHERE bill_id = ? RETURNING product_id, quantity',
+                                (current_bill_id_text,)).fetchall()
         
         # Group items by product_id and sum quantities for duplicate products
-        product_quantities = {}
+        product_quantities = defaultdict(int)
+        product_names = {}
         for item in items:
             product_id = item['product_id']
-            if product_id in product_quantities:
-                product_quantities[product_id]['total_quantity'] += item['quantity']
-            else:
-                product_quantities[product_id] = {
-                    'total_quantity': item['quantity'],
-                    'product_name': item['product_name']
-                }
-        
-        # Check inventory for all new items (considering total quantities)
-        for product_id, data in product_quantities.items():
-            product = conn.execute('SELECT product_id, product_name, quantity FROM inventory WHERE id = ?',
-                                 (product_id,)).fetchone()
+            product_quantities[product_id] += item['quantity']
+            product_names.setdefault(product_id, item['product_name'])
+        
+        # Net inventory change per product: old bill quantity back, new bill quantity out
+        old_quantities = _quantities_by_product(old_items)
+        deltas = defaultdict(int, old_quantities)
+        for product_id, total_quantity in product_quantities.items():
+            deltas[product_id] -= total_quantity
+        
+        # Check inventory for all new items in one query (stock plus what this bill already holds)
+        placeholders = ','.join('?' * len(product_quantities))
+        stock = {row['id']: row for row in conn.execute(
+            f'SELECT id, product_id, product_name, quantity FROM inventory WHERE id IN ({placeholders})',
+            list(product_quantities)).fetchall()}
+        for product_id, total_quantity in product_quantities.items():
+            product = stock.get(product_id)
             if product:
-                if product['quantity'] < data['total_quantity']:
-                    # Restore the old quantities back since we're not proceeding
-                    for old_item in old_items:
-                        conn.execute('UPDATE inventory SET quantity = quantity - ? WHERE id = ?',
-                                    (old_item['quantity'], old_item['product_id']))
-                    conn.commit()
-                    flash(f'Insufficient quantity for {product["product_name"]} (Product ID: {product["product_id"]}). Requested: {data["total_quantity"]}, Available: {product["quantity"]}', 'error')
-                    conn.close()
+                available = product['quantity'] + old_quantities.get(product_id, 0)
+                if available < total_quantity:
+                    conn.rollback()
+                    flash(f'Insufficient quantity for {product["product_name"]} (Product ID: {product["product_id"]}). Requested: {total_quantity}, Available: {available}', 'error')
                     return redirect(url_for('billing.update', bill_id=bill_id))
             else:
-                # Restore the old quantities back since we're not proceeding
-                for old_item in old_items:
-                    conn.execute('UPDATE inventory SET quantity = quantity - ? WHERE id = ?',
-                                (old_item['quantity'], old_item['product_id']))
-                conn.commit()
-                flash(f'Product {data["product_name"]} not found in inventory!', 'error')
-                conn.close()
+                conn.rollback()
+                flash(f'Product {product_names[product_id]} not found in inventory!', 'error')
                 return redirect(url_for('billing.update', bill_id=bill_id))
         
-        # Calculate totals
-        subtotal = sum(float(item['quantity']) * float(item['unit_price']) for item in items)
-        gst_amount = sum(float(item['gst_amount']) for item in items)
-        total_amount = sum(float(item['total']) for item in items)
-        
-        # Update bill header
-        conn.execute('''UPDATE billing SET bill_id = ?, customer_id = ?, bill_date = ?, subtotal = ?, gst_amount = ?,
-                       total_amount = ?, payment_status = ?, notes = ?
-                       WHERE id = ?''',
-                    (new_bill_id, customer_id, bill_date, subtotal, gst_amount, total_amount,
-                     payment_status, notes, bill_id))
-        
-        # Get existing billing_items to update or delete
-        existing_items = conn.execute('SELECT id FROM billing_items WHERE bill_id = ? ORDER BY id',
-                                     (bill_id,)).fetchall()
-        existing_item_ids = [item['id'] for item in existing_items]
-        
-        # Update or insert bill items
-        for i, item in enumerate(items):
-            if i < len(existing_item_ids):
-                # Update existing item
-                item_id = existing_item_ids[i]
-                conn.execute('''UPDATE billing_items
-                               SET product_id = ?, product_name = ?, quantity = ?,
-                                   unit_price = ?, gst_percentage = ?, gst_amount = ?,
-                                   cgst = ?, sgst = ?, igst = ?, total = ?
-                               WHERE id = ?''',
-                            (item['product_id'], item['product_name'], item['quantity'],
-                             item['unit_price'], item['gst_percentage'],
-                             item['gst_amount'], item.get('cgst', 0), item.get('sgst', 0),
-                             item.get('igst', 0), item['total'], item_id))
-            else:
-                # Insert new item
-                conn.execute('''INSERT INTO billing_items (bill_id, product_id, product_name, quantity,
-                               unit_price, gst_percentage, gst_amount, cgst, sgst, igst, total)
-                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                            (bill_id, item['product_id'], item['product_name'], item['quantity'],
-                             item['unit_price'], item['gst_percentage'],
-                             item['gst_amount'], item.get('cgst', 0), item.get('sgst', 0),
-                             item.get('igst', 0), item['total']))
+        # Calculate totals in a single pass (parsed JSON numbers are already int/float)
+        subtotal = gst_amount = total_amount = 0.0
+        for item in items:
+            subtotal += item['quantity'] * item['unit_price']
+            gst_amount += item['gst_amount']
+            total_amount += item['total']
+        
+        try:
+            # Update bill header
+            conn.execute('''UPDATE billing SET bill_id = ?, customer_id = ?, bill_date = ?, subtotal = ?, gst_amount = ?,
+                           total_amount = ?, payment_status = ?, notes = ?
+                           WHERE id = ?''',
+                        (new_bill_id, customer_id, bill_date, subtotal, gst_amount, total_amount,
+                         payment_status, notes, bill_id))
             
-            # Reduce inventory
-            conn.execute('UPDATE inventory SET quantity = quantity - ? WHERE id = ?',
-                        (item['quantity'], item['product_id']))
-        
-        # Delete extra items if new list is shorter than old list
-        if len(items) < len(existing_item_ids):
-            for item_id in existing_item_ids[len(items):]:
-                conn.execute('DELETE FROM billing_items WHERE id = ?', (item_id,))
-        
-        conn.commit()
-        conn.close()
+            # Insert bill items under the (possibly renamed) TEXT bill_id and apply the net changes
+            _insert_bill_items(conn, new_bill_id, items)
+            _apply_inventory_deltas(conn, deltas)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            flash(f'Error updating bill: {str(e)}', 'error')
+            return redirect(url_for('billing.update', bill_id=bill_id))
         
         flash(f'Bill {new_bill_id} updated successfully with {len(items)} item(s)! Inventory updated.', 'success')
         return redirect(url_for('billing.index'))
@@ -864,34 +903,51 @@ def update(bill_id):
     bill = conn.execute('SELECT * FROM billing WHERE id = ?', (bill_id,)).fetchone()
     
     if not bill:
-        conn.close()
         flash('Bill not found!', 'error')
         return redirect(url_for('billing.index'))
     
-    # Get bill items
-    items = conn.execute('SELECT * FROM billing_items WHERE bill_id = ? ORDER BY id', (bill_id,)).fetchall()
+    # Get bill items as dictionaries for JSON serialization
+    bill_items = _fetch_dicts(conn, 'SELECT * FROM billing_items WHERE bill_id = ? ORDER BY id', (bill['bill_id'],))
     
-    # Convert Row objects to dictionaries for JSON serialization
-    customers_rows = conn.execute('SELECT * FROM customers ORDER BY name').fetchall()
-    customers = [dict(row) for row in customers_rows]
+    # Customers and inventory as dictionaries for JSON serialization
+    customers, inventory = _form_choices(conn)
     
-    inventory_rows = conn.execute('SELECT * FROM inventory WHERE quantity > 0 ORDER BY product_name').fetchall()
-    inventory = [dict(row) for row in inventory_rows]
-    
-    # Convert bill items to list of dicts
-    bill_items = [dict(row) for row in items]
-    
-    conn.close()
-    return render_template('billing/update.html', bill=dict(bill), bill_items=bill_items,
+    return render_template('billing/update.html', bill=bill, bill_items=bill_items,
                          customers=customers, inventory=inventory, seller_state=seller_state)
 
+# Column of the export query where the bill columns end and each item's begin
+_EXPORT_ITEM_MARKER = 'item_id'
+
+def _export_bills(conn, cursor):
+    """Yield one {'bill', 'items'} entry per bill from the ordered export rows, then release conn"""
+    try:
+        columns = [col[0] for col in cursor.description]
+        # Split at the marker column, so adding a bill or item column can't shift the other side
+        split = columns.index(_EXPORT_ITEM_MARKER)
+        bill_columns = columns[:split]
+        item_columns = columns[split + 1:]
+        for _, rows in groupby(cursor, key=itemgetter(0)):
+            rows = list(rows)
+            # Plain tuples are zipped with the column names once per row
+            bill = dict(zip(bill_columns, rows[0]))
+            # A bill without items comes back as one row with a NULL item id
+            items = [dict(zip(item_columns, row[split + 1:]))
+                     for row in rows if row[split] is not None]
+            yield {'bill': bill, 'items': items}
+    finally:
+        conn.close()
+
 @billing_bp.route('/active-bills-export')
 def active_bills_export():
     """Display all active bills with detailed item information for Excel export"""
-    conn = get_db_connection()
+    conn = get_db_connection_fast()
+    
+    # Read the count and the rows from the same snapshot
+    conn.execute('BEGIN')
+    bill_count = conn.execute("SELECT COUNT(*) FROM billing WHERE payment_status != 'Cancelled'").fetchone()[0]
     
-    # Get all active bills (not cancelled) with customer details and items
-    bills = conn.execute('''
+    # Get all active bills (not cancelled) with customer details and items in one ordered query
+    cursor = conn.execute('''
         SELECT
             b.id,
             b.bill_id,
@@ -909,40 +965,32 @@ def active_bills_export():
             c.email,
             c.mobile,
             c.address,
-            c.state
+            c.state,
+            bi.id as item_id,  -- _EXPORT_ITEM_MARKER: item columns follow
+            bi.product_name,
+            i.hsn_code,
+            bi.quantity,
+            bi.unit_price,
+            bi.gst_percentage,
+            bi.igst,
+            bi.sgst,
+            bi.cgst,
+            bi.total
         FROM billing b
         JOIN customers c ON b.customer_id = c.id
+        LEFT JOIN billing_items bi ON bi.bill_id = b.bill_id
+        LEFT JOIN inventory i ON bi.product_id = i.id
         WHERE b.payment_status != 'Cancelled'
-        ORDER BY b.created_at DESC
-    ''').fetchall()
-    
-    # Get items for each bill
-    bills_with_items = []
-    for bill in bills:
-        items = conn.execute('''
-            SELECT
-                bi.product_name,
-                i.hsn_code,
-                bi.quantity,
-                bi.unit_price,
-                bi.gst_percentage,
-                bi.igst,
-                bi.sgst,
-                bi.cgst,
-                bi.total
-            FROM billing_items bi
-            LEFT JOIN inventory i ON bi.product_id = i.id
-            WHERE bi.bill_id = ?
-            ORDER BY bi.id
-        ''', (bill['bill_id'],)).fetchall()
-        
-        # Add all bills, even if they have no items
-        bills_with_items.append({
-            'bill': dict(bill),
-            'items': [dict(item) for item in items] if items else []
-        })
+        ORDER BY b.created_at DESC, b.id, bi.id
+    ''')
+    
+    # Read flashed messages now so the session is updated before the
+    # response headers go out; the template then reuses the cached list
+    get_flashed_messages()
     
-    conn.close()
-    return render_template('billing/active_bills_export.html', bills_with_items=bills_with_items)
+    # Stream the page one bill at a time; the connection is released once it is done
+    return Response(stream_template('billing/active_bills_export.html',
+                                    bills_with_items=_export_bills(conn, cursor),
+                                    bill_count=bill_count))
 
 # Made with Bob
@@ -3,12 +3,55 @@ Customer routes module
 Handles all customer-related routes
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-import sqlite3
-from database import get_db_connection
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response
+from database import get_db_connection, data_version, sqlite3
+from routes import not_modified, cacheable, insert_rows
 
 customers_bp = Blueprint('customers', __name__, url_prefix='/customers')
 
+# Columns shown on the customer list
+_LIST_COLUMNS = 'id, customer_id, vendor_code, name, mobile, email, state, gst_number, address'
+
+def _duplicate_message(error):
+    """Flash message for a UNIQUE constraint failure on the customers table"""
+    if 'customers.vendor_code' in str(error):
+        return 'Vendor Code already exists! Please use a unique code.'
+    return 'Customer ID already exists! Please use a unique ID.'
+
+def _next_customer_id(conn):
+    """Return the suggested next customer ID (CUST####)"""
+    # MAX() of the INTEGER PRIMARY KEY is a single seek to the last rowid
+    max_id = conn.execute('SELECT MAX(id) FROM customers').fetchone()[0] or 0
+    return f"CUST{str(max_id+1).zfill(4)}"
+
+# A NULL customer_id is generated inside the INSERT itself so two
+# concurrent adds can't both pick the same next ID
+_INSERT_CUSTOMER_SQL = '''INSERT INTO customers (customer_id, vendor_code, name, email, mobile, address, state, gst_number)
+                          VALUES (COALESCE(?, printf('CUST%04d', (SELECT IFNULL(MAX(id), 0) + 1 FROM customers))),
+                                  ?, ?, ?, ?, ?, ?, ?)'''
+
+# Vendor codes in use, with the data_version() they were read at
+_vendor_code_cache = (None, frozenset())
+
+def _vendor_codes(conn):
+    """Return every vendor code in use, re-reading them only after a database write"""
+    global _vendor_code_cache
+    version = data_version()
+    if _vendor_code_cache[0] != version:
+        codes = frozenset(row[0] for row in conn.execute('SELECT vendor_code FROM customers WHERE vendor_code IS NOT NULL'))
+        _vendor_code_cache = (version, codes)
+    return _vendor_code_cache[1]
+
+def _search_filter(search_query):
+    """WHERE clause and parameters matching customer_id, vendor_code or name containing search_query"""
+    # The trigram index needs three characters and treats % and _ literally,
+    # so shorter or wildcard queries keep the LIKE scan
+    if len(search_query) >= 3 and '%' not in search_query and '_' not in search_query:
+        phrase = '"' + search_query.replace('"', '""') + '"'
+        return 'id IN (SELECT rowid FROM customers_fts WHERE customers_fts MATCH ?)', (phrase,)
+    pattern = f'%{search_query}%'
+    return 'customer_id LIKE ? OR vendor_code LIKE ? OR name LIKE ?', (pattern, pattern, pattern)
+
 @customers_bp.route('/')
 def index():
     """Display all customers with optional search and pagination"""
@@ -24,14 +67,21 @@ def index():
     if page < 1:
         page = 1
     
+    # ?format=json returns just the rows so an AJAX client can render them itself
+    as_json = request.args.get('format') == 'json'
+    
+    # The page only changes with the data, so a client holding this version gets a 304
+    etag = f'customers-{data_version()}' + ('-json' if as_json else '')
+    if not_modified(etag):
+        return cacheable(make_response('', 304), etag)
+    
     conn = get_db_connection()
     
     if search_query:
         # Get total count for search
-        total_count = conn.execute('''
-            SELECT COUNT(*) as count FROM customers
-            WHERE customer_id LIKE ? OR vendor_code LIKE ? OR name LIKE ?
-        ''', (f'%{search_query}%', f'%{search_query}%', f'%{search_query}%')).fetchone()['count']
+        search_sql, search_params = _search_filter(search_query)
+        total_count = conn.execute(f'SELECT COUNT(*) as count FROM customers WHERE {search_sql}',
+                                   search_params).fetchone()['count']
     else:
         # Get total count
         total_count = conn.execute('SELECT COUNT(*) as count FROM customers').fetchone()['count']
@@ -48,34 +98,38 @@ def index():
     
     if search_query:
         # Search by customer_id, vendor_code, or name with pagination
-        customers = conn.execute('''
-            SELECT * FROM customers
-            WHERE customer_id LIKE ? OR vendor_code LIKE ? OR name LIKE ?
+        customers = conn.execute(f'''
+            SELECT {_LIST_COLUMNS} FROM customers
+            WHERE {search_sql}
             ORDER BY created_at DESC
             LIMIT ? OFFSET ?
-        ''', (f'%{search_query}%', f'%{search_query}%', f'%{search_query}%', per_page, offset)).fetchall()
+        ''', search_params + (per_page, offset)).fetchall()
     else:
         # Get paginated customers
-        customers = conn.execute('''
-            SELECT * FROM customers
+        customers = conn.execute(f'''
+            SELECT {_LIST_COLUMNS} FROM customers
             ORDER BY created_at DESC
             LIMIT ? OFFSET ?
         ''', (per_page, offset)).fetchall()
     
-    conn.close()
-    
     has_prev = page > 1
     has_next = page < total_pages
     
-    return render_template('customers/index.html',
-                         customers=customers,
-                         search_query=search_query,
-                         page=page,
-                         per_page=per_page,
-                         total_count=total_count,
-                         total_pages=total_pages,
-                         has_prev=has_prev,
-                         has_next=has_next)
+    if as_json:
+        return cacheable(jsonify(customers=[dict(row) for row in customers], search_query=search_query,
+                                 page=page, per_page=per_page,
+                                 total_count=total_count, total_pages=total_pages,
+                                 has_prev=has_prev, has_next=has_next), etag)
+    
+    return cacheable(make_response(render_template('customers/index.html',
+                                                   customers=customers,
+                                                   search_query=search_query,
+                                                   page=page,
+                                                   per_page=per_page,
+                                                   total_count=total_count,
+                                                   total_pages=total_pages,
+                                                   has_prev=has_prev,
+                                                   has_next=has_next)), etag)
 
 @customers_bp.route('/add', methods=['GET', 'POST'])
 def add():
@@ -92,58 +146,67 @@ def add():
         state = request.form.get('state', '')
         gst_number = request.form.get('gst_number', '')
         
-        # If customer_id not provided for some reason, auto-generate one
-        if not customer_id:
-            conn = get_db_connection()
-            row = conn.execute('SELECT MAX(id) FROM customers').fetchone()
-            max_id = row[0] if row and row[0] else 0
-            customer_id = f"CUST{str(max_id+1).zfill(4)}"
-            conn.close()
-
-        # Validate required fields (customer_id, name, address and state)
-        if not customer_id or not name or not address or not state:
+        # Validate required fields (name, address and state)
+        if not name or not address or not state:
             flash('Customer ID, Customer Name, Address and State are required!', 'error')
             return redirect(url_for('customers.add'))
         
-        # Check if customer_id already exists
+        # Customer ID and vendor code uniqueness is enforced by their UNIQUE indexes
         conn = get_db_connection()
-        existing_cid = conn.execute('SELECT id FROM customers WHERE customer_id = ?', (customer_id,)).fetchone()
-        
-        if existing_cid:
-            conn.close()
-            flash('Customer ID already exists! Please use a unique ID.', 'error')
-            return redirect(url_for('customers.add'))
-        
-        # Check if vendor code already exists (only if provided)
-        if vendor_code:
-            existing_vcode = conn.execute('SELECT id FROM customers WHERE vendor_code = ?', (vendor_code,)).fetchone()
-            if existing_vcode:
-                conn.close()
-                flash('Vendor Code already exists! Please use a unique code.', 'error')
-                return redirect(url_for('customers.add'))
-        
         try:
-            conn.execute('''INSERT INTO customers (customer_id, vendor_code, name, email, mobile, address, state, gst_number)
-                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                        (customer_id, vendor_code, name, email, mobile, address, state, gst_number))
+            conn.execute(_INSERT_CUSTOMER_SQL,
+                        (customer_id or None, vendor_code, name, email, mobile, address, state, gst_number))
             conn.commit()
-            conn.close()
             
             flash('Customer added successfully!', 'success')
             return redirect(url_for('customers.index'))
+        except sqlite3.IntegrityError as e:
+            conn.rollback()
+            flash(_duplicate_message(e), 'error')
+            return redirect(url_for('customers.add'))
         except Exception as e:
-            conn.close()
             flash(f'Error adding customer: {str(e)}', 'error')
             return redirect(url_for('customers.add'))
     
     # For GET: generate a suggested customer_id and render form
-    conn = get_db_connection()
-    row = conn.execute('SELECT MAX(id) FROM customers').fetchone()
-    max_id = row[0] if row and row[0] else 0
-    suggested_cid = f"CUST{str(max_id+1).zfill(4)}"
-    conn.close()
+    suggested_cid = _next_customer_id(get_db_connection())
     return render_template('customers/add.html', customer_id=suggested_cid)
 
+# Fields a bulk-added customer may set, all stored as text
+_BULK_FIELDS = ('customer_id', 'vendor_code', 'name', 'email', 'mobile', 'address', 'state', 'gst_number')
+
+def _valid_bulk_customer(customer):
+    """True when a bulk-add entry has name, address and state and only text values"""
+    return (isinstance(customer, dict)
+            and all(customer.get(f) for f in ('name', 'address', 'state'))
+            and all(isinstance(customer.get(f, ''), str) for f in _BULK_FIELDS))
+
+@customers_bp.route('/bulk-add', methods=['POST'])
+def bulk_add():
+    """AJAX endpoint: add a JSON list of customers in a single transaction"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({'error': 'Expected a JSON list of customers'}), 400
+    
+    # Rows missing a required field or holding a non-text value are reported, not inserted
+    rows, positions, failed = [], [], []
+    for index, customer in enumerate(data):
+        if not _valid_bulk_customer(customer):
+            failed.append(index)
+            continue
+        rows.append((customer.get('customer_id') or None, customer.get('vendor_code') or None,
+                     customer['name'], customer.get('email', ''), customer.get('mobile', ''),
+                     customer['address'], customer['state'], customer.get('gst_number', '')))
+        positions.append(index)
+    
+    # One commit for the whole list; duplicates are skipped and reported
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    failed += [positions[i] for i in insert_rows(conn, _INSERT_CUSTOMER_SQL, rows)]
+    conn.commit()
+    
+    return jsonify({'added': len(data) - len(failed), 'failed': sorted(failed)})
+
 @customers_bp.route('/update/<int:customer_id>', methods=['GET', 'POST'])
 def update(customer_id):
     """Update a customer"""
@@ -163,26 +226,9 @@ def update(customer_id):
         # Validate required fields
         if not new_customer_id or not name or not address or not state:
             flash('Customer ID, Customer Name, Address and State are required!', 'error')
-            conn.close()
-            return redirect(url_for('customers.update', customer_id=customer_id))
-        
-        # Check if new customer_id already exists (excluding current customer)
-        existing_cid = conn.execute('SELECT id FROM customers WHERE customer_id = ? AND id != ?',
-                                   (new_customer_id, customer_id)).fetchone()
-        if existing_cid:
-            conn.close()
-            flash('Customer ID already exists! Please use a unique ID.', 'error')
             return redirect(url_for('customers.update', customer_id=customer_id))
         
-        # Check if vendor code already exists (excluding current customer, only if provided)
-        if vendor_code:
-            existing_vcode = conn.execute('SELECT id FROM customers WHERE vendor_code = ? AND id != ?',
-                                         (vendor_code, customer_id)).fetchone()
-            if existing_vcode:
-                conn.close()
-                flash('Vendor Code already exists! Please use a unique code.', 'error')
-                return redirect(url_for('customers.update', customer_id=customer_id))
-        
+        # Customer ID and vendor code uniqueness is enforced by their UNIQUE indexes
         try:
             conn.execute('''UPDATE customers
                            SET customer_id = ?, vendor_code = ?, name = ?, email = ?,
@@ -190,18 +236,19 @@ def update(customer_id):
                            WHERE id = ?''',
                         (new_customer_id, vendor_code, name, email, mobile, address, state, gst_number, customer_id))
             conn.commit()
-            conn.close()
             
             flash('Customer updated successfully!', 'success')
             return redirect(url_for('customers.index'))
+        except sqlite3.IntegrityError as e:
+            conn.rollback()
+            flash(_duplicate_message(e), 'error')
+            return redirect(url_for('customers.update', customer_id=customer_id))
         except Exception as e:
-            conn.close()
             flash(f'Error updating customer: {str(e)}', 'error')
             return redirect(url_for('customers.update', customer_id=customer_id))
     
     # GET request - show update form
     customer = conn.execute('SELECT * FROM customers WHERE id = ?', (customer_id,)).fetchone()
-    conn.close()
     
     if not customer:
         flash('Customer not found!', 'error')
@@ -215,7 +262,6 @@ def delete(id):
     conn = get_db_connection()
     conn.execute('DELETE FROM customers WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
     
     flash('Customer deleted successfully!', 'success')
     return redirect(url_for('customers.index'))
@@ -233,7 +279,6 @@ def delete_multiple():
     placeholders = ','.join('?' * len(customer_ids))
     conn.execute(f'DELETE FROM customers WHERE id IN ({placeholders})', customer_ids)
     conn.commit()
-    conn.close()
     
     flash(f'{len(customer_ids)} customer(s) deleted successfully!', 'success')
     return redirect(url_for('customers.index'))
@@ -252,10 +297,8 @@ def check_vendor():
     if not vendor_code:
         return jsonify({'exists': False})
 
+    # Answered from the cached set, as the form calls this on every keystroke
     conn = get_db_connection()
-    existing = conn.execute('SELECT id FROM customers WHERE vendor_code = ?', (vendor_code,)).fetchone()
-    conn.close()
-
-    return jsonify({'exists': bool(existing)})
+    return jsonify({'exists': vendor_code in _vendor_codes(conn)})
 
 # Made with Bob
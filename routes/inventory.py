@@ -3,13 +3,85 @@ Inventory routes module
 Handles all inventory-related routes
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from database import get_db_connection
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
+import functools
+import json
+import re
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, jsonify, make_response
+from database import get_db_connection, data_version, sqlite3
+from routes import not_modified, cacheable, insert_rows
+from datetime import date
 
 inventory_bp = Blueprint('inventory', __name__, url_prefix='/inventory')
 
+# SQL for the product ID after the newest product: PROD#### with the newest
+# product's number plus one, or PROD0001 when that ID isn't of this form
+_NEXT_PRODUCT_ID_SQL = '''printf('PROD%04d', IFNULL((
+    SELECT CAST(SUBSTR(product_id, 5) AS INTEGER) FROM inventory
+    WHERE id = (SELECT MAX(id) FROM inventory)
+      AND product_id GLOB 'PROD[0-9]*' AND SUBSTR(product_id, 5) NOT GLOB '*[^0-9]*'), 0) + 1)'''
+
+# Next product ID, with the data_version() it was computed at
+_next_product_id_cache = (None, None)
+
+def _next_product_id(conn):
+    """Return the suggested next product ID (PROD####) for the add form"""
+    global _next_product_id_cache
+    version = data_version()
+    if _next_product_id_cache[0] != version:
+        # Only a suggestion: an add with no product_id generates its own inside the INSERT
+        _next_product_id_cache = (version, conn.execute(f'SELECT {_NEXT_PRODUCT_ID_SQL}').fetchone()[0])
+    return _next_product_id_cache[1]
+
+def _item_fields(form):
+    """Read the product fields shared by the add and update forms"""
+    return (form.get('hsn_code', '').strip(),
+            form.get('manufacture_date', ''),
+            form.get('expiry_months', 0),
+            form.get('quantity', 0),
+            form.get('buy_price', 0.0),
+            form.get('unit_price', 0.0),
+            form.get('mrp', 0.0),
+            form.get('gst_percentage', 0.0))
+
+# Manufacture dates are stored exactly as the form's YYYY-MM-DD date input sends them
+_ISO_DATE_RE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+
+# Forms tend to repeat the same batch dates, so results are memoised
+@functools.lru_cache(maxsize=512)
+def _expiry_month(manufacture_date, expiry_months):
+    """Return the YYYY-MM month that is expiry_months after a YYYY-MM-DD manufacture date"""
+    # fromisoformat also takes forms like 20240115 or 2024-W03-1, so check the
+    # exact shape first; it then rejects impossible dates such as 2025-02-30
+    if not _ISO_DATE_RE.fullmatch(manufacture_date):
+        raise ValueError(f'Not a YYYY-MM-DD date: {manufacture_date!r}')
+    mfg_date = date.fromisoformat(manufacture_date)
+    total = mfg_date.month + int(expiry_months) - 1
+    return f'{mfg_date.year + total // 12:04d}-{total % 12 + 1:02d}'
+
+def _dict_row(cursor, row):
+    """Row factory returning each row as a plain dict keyed by column name"""
+    return dict(zip([column[0] for column in cursor.description], row))
+
+# Serialised product list, with the data_version() it was read at
+_products_json_cache = (None, b'')
+
+def _products_json():
+    """Return every product as a JSON array, re-reading them only after a database write"""
+    global _products_json_cache
+    version = data_version()
+    if _products_json_cache[0] != version:
+        # Build dicts straight from the cursor instead of going through sqlite3.Row
+        cursor = get_db_connection().cursor()
+        cursor.row_factory = _dict_row
+        products_list = cursor.execute('SELECT * FROM inventory ORDER BY product_name').fetchall()
+        _products_json_cache = (version, jsonify(products_list).get_data())
+    return _products_json_cache[1]
+
+# Shared by add and bulk_add; a NULL product_id is generated inside the INSERT
+# itself so two concurrent adds can't both pick the same next ID
+_INSERT_ITEM_SQL = f'''INSERT INTO inventory (product_id, product_name, hsn_code, manufacture_date, expiry_month, quantity, buy_price, unit_price, mrp, gst_percentage)
+                       VALUES (COALESCE(?, {_NEXT_PRODUCT_ID_SQL}), ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
 @inventory_bp.route('/')
 def index():
     """Display all inventory items with pagination"""
@@ -24,6 +96,14 @@ def index():
     if page < 1:
         page = 1
     
+    # ?format=json returns just the rows so an AJAX client can render them itself
+    as_json = request.args.get('format') == 'json'
+    
+    # The page only changes with the data, so a client holding this version gets a 304
+    etag = f'inventory-{data_version()}' + ('-json' if as_json else '')
+    if not_modified(etag):
+        return cacheable(make_response('', 304), etag)
+    
     conn = get_db_connection()
     
     # Get total count
@@ -39,129 +119,127 @@ def index():
     # Calculate offset
     offset = (page - 1) * per_page
     
-    # Get paginated items
+    # Get paginated items (only the columns the list shows)
     items = conn.execute(
-        'SELECT * FROM inventory ORDER BY created_at DESC LIMIT ? OFFSET ?',
+        '''SELECT id, product_id, product_name, hsn_code, manufacture_date, expiry_month, quantity,
+                  buy_price, unit_price, mrp, gst_percentage, updated_at
+           FROM inventory ORDER BY created_at DESC LIMIT ? OFFSET ?''',
         (per_page, offset)
     ).fetchall()
     
-    conn.close()
-    
     has_prev = page > 1
     has_next = page < total_pages
     
-    return render_template('inventory/index.html',
-                         items=items,
-                         page=page,
-                         per_page=per_page,
-                         total_count=total_count,
-                         total_pages=total_pages,
-                         has_prev=has_prev,
-                         has_next=has_next)
+    if as_json:
+        return cacheable(jsonify(items=[dict(row) for row in items], page=page, per_page=per_page,
+                                 total_count=total_count, total_pages=total_pages,
+                                 has_prev=has_prev, has_next=has_next), etag)
+    
+    return cacheable(make_response(render_template('inventory/index.html',
+                                                   items=items,
+                                                   page=page,
+                                                   per_page=per_page,
+                                                   total_count=total_count,
+                                                   total_pages=total_pages,
+                                                   has_prev=has_prev,
+                                                   has_next=has_next)), etag)
 
 @inventory_bp.route('/api/products')
 def api_products():
     """API endpoint to get all products for autocomplete"""
-    conn = get_db_connection()
-    products = conn.execute('SELECT * FROM inventory ORDER BY product_name').fetchall()
-    conn.close()
+    # The list only changes with the data, so a client holding this version gets a 304
+    etag = f'products-{data_version()}'
+    if not_modified(etag):
+        return cacheable(make_response('', 304), etag)
     
-    # Convert to list of dicts
-    products_list = [dict(row) for row in products]
-    return jsonify(products_list)
+    return cacheable(current_app.response_class(_products_json(), mimetype='application/json'), etag)
 
 @inventory_bp.route('/api/next-product-id')
 def next_product_id():
     """API endpoint to get the next auto-generated product ID"""
-    conn = get_db_connection()
-    
-    # Get the last product_id
-    last_product = conn.execute('SELECT product_id FROM inventory ORDER BY id DESC LIMIT 1').fetchone()
-    
-    if last_product and last_product['product_id']:
-        # Extract number from last product_id (e.g., PROD0001 -> 1)
-        try:
-            last_num = int(last_product['product_id'].replace('PROD', ''))
-            next_num = last_num + 1
-        except (ValueError, AttributeError):
-            next_num = 1
-    else:
-        next_num = 1
-    
-    # Format as PROD0001, PROD0002, etc.
-    product_id = f'PROD{next_num:04d}'
-    
-    conn.close()
-    
-    return jsonify({'product_id': product_id})
+    return jsonify({'product_id': _next_product_id(get_db_connection())})
 
 @inventory_bp.route('/add', methods=['GET', 'POST'])
 def add():
     """Add a new inventory item"""
     if request.method == 'POST':
         product_id = request.form.get('product_id', '').strip()
-        
-        # Auto-generate product_id if not provided or empty
-        if not product_id:
-            conn = get_db_connection()
-            last_product = conn.execute('SELECT product_id FROM inventory ORDER BY id DESC LIMIT 1').fetchone()
-            
-            if last_product and last_product['product_id']:
-                try:
-                    last_num = int(last_product['product_id'].replace('PROD', ''))
-                    next_num = last_num + 1
-                except (ValueError, AttributeError):
-                    next_num = 1
-            else:
-                next_num = 1
-            
-            product_id = f'PROD{next_num:04d}'
-            conn.close()
-        
         product_name = request.form['product_name']
-        hsn_code = request.form.get('hsn_code', '').strip()
-        manufacture_date = request.form.get('manufacture_date', '')
-        expiry_months = request.form.get('expiry_months', 0)
-        quantity = request.form.get('quantity', 0)
-        buy_price = request.form.get('buy_price', 0.0)
-        unit_price = request.form.get('unit_price', 0.0)
-        mrp = request.form.get('mrp', 0.0)
-        gst_percentage = request.form.get('gst_percentage', 0.0)
+        (hsn_code, manufacture_date, expiry_months, quantity,
+         buy_price, unit_price, mrp, gst_percentage) = _item_fields(request.form)
         
         # Calculate expiry month from manufacture date + expiry months
         expiry_month = ''
         if manufacture_date and expiry_months:
             try:
-                mfg_date = datetime.strptime(manufacture_date, '%Y-%m-%d')
-                expiry_date = mfg_date + relativedelta(months=int(expiry_months))
-                expiry_month = expiry_date.strftime('%Y-%m')
-            except:
+                expiry_month = _expiry_month(manufacture_date, expiry_months)
+            except ValueError:
                 flash('Invalid manufacture date or expiry months!', 'error')
-                return redirect(url_for('inventory.add'))
+                return render_template('inventory/add.html', form_data=request.form.to_dict()), 400
         
-        if not product_id or not product_name or not hsn_code or not manufacture_date or not expiry_months:
+        # An empty product_id is generated below, so it isn't checked here
+        if not product_name or not hsn_code or not manufacture_date or not expiry_months:
             flash('Product ID, Product Name, HSN Code, Manufacture Date, and Expiry Months are required!', 'error')
-            return redirect(url_for('inventory.add'))
+            return render_template('inventory/add.html', form_data=request.form.to_dict()), 400
         
+        # Validation passed - only now touch the database
         conn = get_db_connection()
         
-        # Check if product_id already exists
-        existing = conn.execute('SELECT id FROM inventory WHERE product_id = ?', (product_id,)).fetchone()
-        if existing:
-            flash('Product ID already exists!', 'error')
-            conn.close()
-            return redirect(url_for('inventory.add'))
-        
-        conn.execute('''INSERT INTO inventory (product_id, product_name, hsn_code, manufacture_date, expiry_month, quantity, buy_price, unit_price, mrp, gst_percentage)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                     (product_id, product_name, hsn_code, manufacture_date, expiry_month, quantity, buy_price, unit_price, mrp, gst_percentage))
+        # Product ID uniqueness is enforced by its UNIQUE index; a clash inserts
+        # nothing and returns no row instead of raising
+        added = conn.execute(_INSERT_ITEM_SQL + ' ON CONFLICT(product_id) DO NOTHING RETURNING id',
+                             (product_id or None, product_name, hsn_code, manufacture_date, expiry_month, quantity, buy_price, unit_price, mrp, gst_percentage)).fetchone()
         conn.commit()
-        conn.close()
+        
+        if added is None:
+            flash('Product ID already exists!', 'error')
+            return render_template('inventory/add.html', form_data=request.form.to_dict()), 400
         
         flash('Inventory item added successfully!', 'success')
         return redirect(url_for('inventory.index'))
     
-    return render_template('inventory/add.html')
+    return render_template('inventory/add.html', form_data=None)
+
+# Fields a bulk-added item may set, by the JSON types they accept (bool is
+# excluded separately, since it is a subclass of int)
+_BULK_TEXT_FIELDS = ('product_id', 'product_name', 'hsn_code', 'manufacture_date', 'expiry_month')
+_BULK_NUMBER_FIELDS = ('buy_price', 'unit_price', 'mrp', 'gst_percentage')
+
+def _valid_bulk_item(item):
+    """True when a bulk-add entry has product_id, product_name and expiry_month and well-typed values"""
+    if not isinstance(item, dict) or not all(item.get(f) for f in ('product_id', 'product_name', 'expiry_month')):
+        return False
+    if not all(isinstance(item.get(f, ''), str) for f in _BULK_TEXT_FIELDS):
+        return False
+    numbers = [(item.get('quantity', 0), int)] + [(item.get(f, 0.0), (int, float)) for f in _BULK_NUMBER_FIELDS]
+    return all(isinstance(value, types) and not isinstance(value, bool) for value, types in numbers)
+
+@inventory_bp.route('/bulk-add', methods=['POST'])
+def bulk_add():
+    """AJAX endpoint: add a JSON list of inventory items in a single transaction"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({'error': 'Expected a JSON list of items'}), 400
+    
+    # Rows missing a required field or holding a value of the wrong type are reported, not inserted
+    rows, positions, failed = [], [], []
+    for index, item in enumerate(data):
+        if not _valid_bulk_item(item):
+            failed.append(index)
+            continue
+        rows.append((item['product_id'], item['product_name'], item.get('hsn_code', ''),
+                     item.get('manufacture_date', ''), item['expiry_month'], item.get('quantity', 0),
+                     item.get('buy_price', 0.0), item.get('unit_price', 0.0), item.get('mrp', 0.0),
+                     item.get('gst_percentage', 0.0)))
+        positions.append(index)
+    
+    # One commit for the whole list; duplicate product IDs are skipped and reported
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    failed += [positions[i] for i in insert_rows(conn, _INSERT_ITEM_SQL, rows)]
+    conn.commit()
+    
+    return jsonify({'added': len(data) - len(failed), 'failed': sorted(failed)})
 
 @inventory_bp.route('/delete/<int:id>')
 def delete(id):
@@ -169,7 +247,6 @@ def delete(id):
     conn = get_db_connection()
     conn.execute('DELETE FROM inventory WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
     
     flash('Inventory item deleted successfully!', 'success')
     return redirect(url_for('inventory.index'))
@@ -177,21 +254,28 @@ def delete(id):
 @inventory_bp.route('/delete-multiple', methods=['POST'])
 def delete_multiple():
     """Delete multiple inventory items"""
-    item_ids = request.form.getlist('item_ids[]')
+    item_ids = request.form.getlist('item_ids[]', type=int)
     
     if not item_ids:
         flash('No items selected!', 'error')
         return redirect(url_for('inventory.index'))
     
+    # Pass the ids as one JSON array so the statement text (and its cached
+    # prepared plan) is the same however many items are selected
     conn = get_db_connection()
-    placeholders = ','.join('?' * len(item_ids))
-    conn.execute(f'DELETE FROM inventory WHERE id IN ({placeholders})', item_ids)
+    conn.execute('DELETE FROM inventory WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(item_ids),))
     conn.commit()
-    conn.close()
     
     flash(f'{len(item_ids)} item(s) deleted successfully!', 'success')
     return redirect(url_for('inventory.index'))
 
+def _update_page(conn, id, form=None):
+    """Render the update form with the item as currently stored, overlaid with any submitted values"""
+    item = conn.execute('SELECT * FROM inventory WHERE id = ?', (id,)).fetchone()
+    if form is not None:
+        item = dict(item, **form.to_dict())
+    return render_template('inventory/update.html', item=item)
+
 @inventory_bp.route('/update/<int:id>', methods=['GET', 'POST'])
 def update(id):
     """Update inventory item"""
@@ -200,51 +284,37 @@ def update(id):
     if request.method == 'POST':
         product_id = request.form['product_id']
         product_name = request.form['product_name']
-        hsn_code = request.form.get('hsn_code', '').strip()
-        manufacture_date = request.form.get('manufacture_date', '')
-        expiry_months = request.form.get('expiry_months', 0)
-        quantity = request.form.get('quantity', 0)
-        buy_price = request.form.get('buy_price', 0.0)
-        unit_price = request.form.get('unit_price', 0.0)
-        mrp = request.form.get('mrp', 0.0)
-        gst_percentage = request.form.get('gst_percentage', 0.0)
+        (hsn_code, manufacture_date, expiry_months, quantity,
+         buy_price, unit_price, mrp, gst_percentage) = _item_fields(request.form)
         
         # Calculate expiry month from manufacture date + expiry months
         expiry_month = ''
         if manufacture_date and expiry_months:
             try:
-                mfg_date = datetime.strptime(manufacture_date, '%Y-%m-%d')
-                expiry_date = mfg_date + relativedelta(months=int(expiry_months))
-                expiry_month = expiry_date.strftime('%Y-%m')
-            except:
+                expiry_month = _expiry_month(manufacture_date, expiry_months)
+            except ValueError:
                 flash('Invalid manufacture date or expiry months!', 'error')
-                conn.close()
-                return redirect(url_for('inventory.update', id=id))
+                return _update_page(conn, id, request.form), 400
         
         if not product_id or not product_name or not hsn_code or not manufacture_date or not expiry_months:
             flash('Product ID, Product Name, HSN Code, Manufacture Date, and Expiry Months are required!', 'error')
-            conn.close()
-            return redirect(url_for('inventory.update', id=id))
+            return _update_page(conn, id, request.form), 400
         
-        # Check if product_id already exists (excluding current item)
-        existing = conn.execute('SELECT id FROM inventory WHERE product_id = ? AND id != ?', (product_id, id)).fetchone()
-        if existing:
+        # Product ID uniqueness is enforced by its UNIQUE index
+        try:
+            conn.execute('''UPDATE inventory SET product_id = ?, product_name = ?, hsn_code = ?, manufacture_date = ?,
+                            expiry_month = ?, quantity = ?, buy_price = ?, unit_price = ?, mrp = ?, gst_percentage = ?,
+                            updated_at = CURRENT_TIMESTAMP WHERE id = ?''',
+                         (product_id, product_name, hsn_code, manufacture_date, expiry_month, quantity, buy_price, unit_price, mrp, gst_percentage, id))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.rollback()
             flash('Product ID already exists!', 'error')
-            conn.close()
-            return redirect(url_for('inventory.update', id=id))
-        
-        conn.execute('''UPDATE inventory SET product_id = ?, product_name = ?, hsn_code = ?, manufacture_date = ?,
-                        expiry_month = ?, quantity = ?, buy_price = ?, unit_price = ?, mrp = ?, gst_percentage = ?,
-                        updated_at = CURRENT_TIMESTAMP WHERE id = ?''',
-                     (product_id, product_name, hsn_code, manufacture_date, expiry_month, quantity, buy_price, unit_price, mrp, gst_percentage, id))
-        conn.commit()
-        conn.close()
+            return _update_page(conn, id, request.form), 400
         
         flash('Inventory updated successfully!', 'success')
         return redirect(url_for('inventory.index'))
     
-    item = conn.execute('SELECT * FROM inventory WHERE id = ?', (id,)).fetchone()
-    conn.close()
-    return render_template('inventory/update.html', item=item)
+    return _update_page(conn, id)
 
 # Made with Bob
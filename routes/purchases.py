@@ -5,10 +5,18 @@ Handles all purchase-related routes and inventory updates
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from database import get_db_connection
-from datetime import datetime
 
 purchases_bp = Blueprint('purchases', __name__, url_prefix='/purchases')
 
+def _purchase_fields(form):
+    """Read the quantity, prices and date shared by the add and confirm forms"""
+    return (int(form['quantity']),
+            float(form['buy_price']),
+            float(form['unit_price']),
+            float(form['mrp']),
+            float(form['gst_percentage']),
+            form['purchase_date'])
+
 @purchases_bp.route('/')
 def index():
     """Display all purchases with pagination"""
@@ -38,15 +46,15 @@ def index():
     # Calculate offset
     offset = (page - 1) * per_page
     
-    # Get paginated purchases
+    # Get paginated purchases (only the columns the list shows)
     purchases = conn.execute('''
-        SELECT * FROM purchases
+        SELECT id, product_id, product_name, hsn_code, manufacture_date, expiry_month, quantity,
+               buy_price, unit_price, mrp, gst_percentage, purchase_date
+        FROM purchases
         ORDER BY purchase_date DESC, created_at DESC
         LIMIT ? OFFSET ?
     ''', (per_page, offset)).fetchall()
     
-    conn.close()
-    
     has_prev = page > 1
     has_next = page < total_pages
     
@@ -67,32 +75,26 @@ def add():
         hsn_code = request.form.get('hsn_code', '').strip()
         manufacture_month = request.form['manufacture_month']  # Format: YYYY-MM
         expiry_month = request.form['expiry_month'].strip()
-        quantity = int(request.form['quantity'])
-        buy_price = float(request.form['buy_price'])
-        unit_price = float(request.form['unit_price'])
-        mrp = float(request.form['mrp'])
-        gst_percentage = float(request.form['gst_percentage'])
-        purchase_date = request.form['purchase_date']
+        quantity, buy_price, unit_price, mrp, gst_percentage, purchase_date = _purchase_fields(request.form)
         
         if not product_name or not manufacture_month or not expiry_month or quantity <= 0:
             flash('Please fill in all required fields with valid values!', 'error')
-            return redirect(url_for('purchases.add'))
+            return render_template('purchases/add.html', form_data=request.form.to_dict()), 400
         
         # Convert manufacture month to full date (1st of the month)
-        from datetime import datetime
         manufacture_date = f"{manufacture_month}-01"  # YYYY-MM-01
         
         conn = get_db_connection()
         
         # Check if product exists in inventory by product_name AND manufacture_date
+        # (only the columns the confirmation page shows)
         existing_product = conn.execute(
-            'SELECT * FROM inventory WHERE product_name = ? AND manufacture_date = ?',
+            'SELECT product_id, quantity FROM inventory WHERE product_name = ? AND manufacture_date = ? LIMIT 1',
             (product_name, manufacture_date)
         ).fetchone()
         
         if existing_product:
             # Show confirmation page with inventory update details
-            conn.close()
             return render_template('purchases/add_confirm.html',
                                  product_name=product_name,
                                  hsn_code=hsn_code,
@@ -107,9 +109,11 @@ def add():
                                  purchase_date=purchase_date,
                                  existing_product=dict(existing_product))
         else:
-            # Product doesn't exist, generate product_id and add to both tables
+            # Product doesn't exist, generate product_id and add to both tables in one transaction
             try:
-                # Generate auto product_id
+                conn.execute('BEGIN IMMEDIATE')
+                
+                # Generate auto product_id while holding the write lock so concurrent purchases can't share it
                 last_product = conn.execute('SELECT product_id FROM inventory ORDER BY id DESC LIMIT 1').fetchone()
                 if last_product and last_product['product_id']:
                     try:
@@ -145,13 +149,11 @@ def add():
             except Exception as e:
                 conn.rollback()
                 flash(f'Error adding purchase: {str(e)}', 'error')
-            finally:
-                conn.close()
             
             return redirect(url_for('purchases.index'))
     
     # GET request - show form
-    return render_template('purchases/add.html')
+    return render_template('purchases/add.html', form_data=None)
 
 @purchases_bp.route('/confirm-add', methods=['POST'])
 def confirm_add():
@@ -161,16 +163,14 @@ def confirm_add():
     hsn_code = request.form.get('hsn_code', '')
     manufacture_date = request.form['manufacture_date']
     expiry_month = request.form['expiry_month']
-    quantity = int(request.form['quantity'])
-    buy_price = float(request.form['buy_price'])
-    unit_price = float(request.form['unit_price'])
-    mrp = float(request.form['mrp'])
-    gst_percentage = float(request.form['gst_percentage'])
-    purchase_date = request.form['purchase_date']
+    quantity, buy_price, unit_price, mrp, gst_percentage, purchase_date = _purchase_fields(request.form)
     
     conn = get_db_connection()
     
+    # Record the purchase and the stock increase in one transaction
     try:
+        conn.execute('BEGIN IMMEDIATE')
+        
         # Add to purchases table (use existing product_id)
         conn.execute('''
             INSERT INTO purchases (product_id, product_name, hsn_code, manufacture_date,
@@ -180,21 +180,24 @@ def confirm_add():
         ''', (existing_product_id, product_name, hsn_code, manufacture_date, expiry_month,
               quantity, buy_price, unit_price, mrp, gst_percentage, purchase_date))
         
-        # Update inventory quantity by product_name and manufacture_date
+        # Add the quantity to the existing product in a single upsert on its unique
+        # product_id; a product deleted since the confirmation page is re-created
         conn.execute('''
-            UPDATE inventory
-            SET quantity = quantity + ?,
+            INSERT INTO inventory (product_id, product_name, hsn_code, manufacture_date,
+                                 expiry_month, quantity, buy_price, unit_price, mrp,
+                                 gst_percentage)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(product_id) DO UPDATE
+            SET quantity = quantity + excluded.quantity,
                 updated_at = CURRENT_TIMESTAMP
-            WHERE product_name = ? AND manufacture_date = ?
-        ''', (quantity, product_name, manufacture_date))
+        ''', (existing_product_id, product_name, hsn_code, manufacture_date, expiry_month,
+              quantity, buy_price, unit_price, mrp, gst_percentage))
         
         conn.commit()
         flash(f'Purchase recorded! Added {quantity} units of "{product_name}" to inventory.', 'success')
     except Exception as e:
         conn.rollback()
         flash(f'Error processing purchase: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('purchases.index'))
 
@@ -203,12 +206,11 @@ def delete(id):
     """Delete a purchase record"""
     conn = get_db_connection()
     
-    # Get purchase details
-    purchase = conn.execute('SELECT * FROM purchases WHERE id = ?', (id,)).fetchone()
+    # Check the purchase exists
+    purchase = conn.execute('SELECT 1 FROM purchases WHERE id = ?', (id,)).fetchone()
     
     if not purchase:
         flash('Purchase not found!', 'error')
-        conn.close()
         return redirect(url_for('purchases.index'))
     
     try:
@@ -219,8 +221,6 @@ def delete(id):
     except Exception as e:
         conn.rollback()
         flash(f'Error deleting purchase: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('purchases.index'))
 
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for billing routes
+"""
+
+import json
+import unittest
+from unittest import mock
+
+import database
+from database import sqlite3
+from app import app
+from test_database import DatabaseTestCase
+
+class BillingTestCase(DatabaseTestCase):
+    """Fresh schema with one customer, one product and a client for every test"""
+
+    def setUp(self):
+        super().setUp()
+        database.init_db()
+        conn = sqlite3.connect(self.path)
+        conn.execute("INSERT INTO customers (customer_id, name, address, state) VALUES ('CUST0001', 'Alpha', 'a', 'Kerala')")
+        conn.execute('''INSERT INTO inventory (product_id, product_name, hsn_code, expiry_month, quantity, unit_price, gst_percentage)
+                        VALUES ('PROD0001', 'Widget', '1234', '2027-01', 50, 10.0, 5.0)''')
+        conn.commit()
+        conn.close()
+        self.client = app.test_client()
+
+    def add_bill(self, bill_id, product_name):
+        """Insert a bill with one item and return its billing.id"""
+        conn = sqlite3.connect(self.path)
+        id = conn.execute("INSERT INTO billing (bill_id, customer_id, bill_date) VALUES (?, 1, '2025-01-15') RETURNING id",
+                          (bill_id,)).fetchone()[0]
+        conn.execute('''INSERT INTO billing_items (bill_id, product_id, product_name, quantity, unit_price, total)
+                        VALUES (?, 1, ?, 2, 10.0, 20.0)''', (bill_id, product_name))
+        conn.commit()
+        conn.close()
+        return id
+
+class PrintMultipleTest(BillingTestCase):
+
+    def test_numeric_manual_bill_id(self):
+        # billing_items.bill_id has INTEGER affinity, so '123' is stored as 123
+        numeric = self.add_bill('123', 'Numeric item')
+        text = self.add_bill('ST1', 'Text item')
+        response = self.client.get(f'/billing/print-multiple?bill_ids={numeric},{text}')
+        self.assertEqual(response.status_code, 200)
+        page = response.get_data(as_text=True)
+        self.assertIn('Numeric item', page)
+        self.assertIn('Text item', page)
+
+class CreateBillTest(BillingTestCase):
+
+    def test_rejects_non_finite_numbers(self):
+        # orjson refuses NaN and Infinity but the json.loads fallback accepts
+        # them, and they must not reach the totals either way
+        for value in ('NaN', 'Infinity', '-Infinity'):
+            items = ('[{"product_id": 1, "product_name": "Widget", "quantity": 1, "unit_price": %s, '
+                     '"subtotal": 10, "gst_percentage": 5, "gst_amount": 0.5, "total": 10.5}]' % value)
+            with mock.patch('routes.billing.json_loads', json.loads):
+                response = self.client.post('/billing/create', data={
+                    'bill_id_mode': 'auto', 'customer_id': '1', 'bill_date': '2025-01-15', 'items_data': items,
+                })
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Invalid bill items data!', response.get_data(as_text=True))
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM billing').fetchone()[0], 0)
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
+
+# Made with Bob
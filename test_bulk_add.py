@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the customer and inventory bulk-add endpoints
+"""
+
+import unittest
+
+import database
+from database import sqlite3
+from app import app
+from test_database import DatabaseTestCase
+
+class BulkAddTestCase(DatabaseTestCase):
+    """Fresh schema and a test client for every test"""
+
+    def setUp(self):
+        super().setUp()
+        database.init_db()
+        self.client = app.test_client()
+
+    def rows(self, sql):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute(sql).fetchall()
+        conn.close()
+        return rows
+
+class CustomerBulkAddTest(BulkAddTestCase):
+
+    def test_clean_batch(self):
+        response = self.client.post('/customers/bulk-add', json=[
+            {'name': 'Alpha', 'address': 'Street 1', 'state': 'Kerala'},
+            {'name': 'Beta', 'address': 'Street 2', 'state': 'Goa', 'vendor_code': 'V1'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'added': 2, 'failed': []})
+        self.assertEqual(self.rows('SELECT customer_id, name FROM customers ORDER BY id'),
+                         [('CUST0001', 'Alpha'), ('CUST0002', 'Beta')])
+
+    def test_duplicate_rows_are_skipped(self):
+        response = self.client.post('/customers/bulk-add', json=[
+            {'name': 'Alpha', 'address': 'a', 'state': 's', 'vendor_code': 'V1'},
+            {'name': 'Beta', 'address': 'a', 'state': 's', 'vendor_code': 'V1'},
+            {'name': 'Gamma', 'address': 'a', 'state': 's'},
+        ])
+        self.assertEqual(response.get_json(), {'added': 2, 'failed': [1]})
+        self.assertEqual(self.rows('SELECT name FROM customers ORDER BY id'), [('Alpha',), ('Gamma',)])
+
+    def test_bad_rows_are_reported(self):
+        response = self.client.post('/customers/bulk-add', json=[
+            {'name': 'N', 'address': 'a', 'state': 's', 'email': {'x': 1}},
+            {'name': 'N', 'address': 'a'},
+            {'name': ['N'], 'address': 'a', 'state': 's'},
+            'not an object',
+            {'name': 'Good', 'address': 'a', 'state': 's'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'added': 1, 'failed': [0, 1, 2, 3]})
+        self.assertEqual(self.rows('SELECT name FROM customers'), [('Good',)])
+
+    def test_rejects_non_list(self):
+        response = self.client.post('/customers/bulk-add', json={'name': 'N'})
+        self.assertEqual(response.status_code, 400)
+
+class InventoryBulkAddTest(BulkAddTestCase):
+
+    def item(self, product_id, **fields):
+        return dict({'product_id': product_id, 'product_name': 'Item', 'expiry_month': '2027-01'}, **fields)
+
+    def test_clean_batch(self):
+        response = self.client.post('/inventory/bulk-add', json=[
+            self.item('PROD0001', quantity=5, unit_price=10.5),
+            self.item('PROD0002'),
+        ])
+        self.assertEqual(response.get_json(), {'added': 2, 'failed': []})
+        self.assertEqual(self.rows('SELECT product_id, quantity, unit_price FROM inventory ORDER BY id'),
+                         [('PROD0001', 5, 10.5), ('PROD0002', 0, 0.0)])
+
+    def test_duplicate_rows_are_skipped(self):
+        response = self.client.post('/inventory/bulk-add', json=[
+            self.item('PROD0001'), self.item('PROD0001'), self.item('PROD0002'),
+        ])
+        self.assertEqual(response.get_json(), {'added': 2, 'failed': [1]})
+        self.assertEqual(self.rows('SELECT product_id FROM inventory ORDER BY id'), [('PROD0001',), ('PROD0002',)])
+
+    def test_bad_rows_are_reported(self):
+        response = self.client.post('/inventory/bulk-add', json=[
+            self.item('PROD0001', quantity='many'),
+            self.item('PROD0002', quantity=1.5),
+            self.item('PROD0003', mrp={'x': 1}),
+            self.item('PROD0004', unit_price=True),
+            self.item('PROD0005', hsn_code=1234),
+            {'product_id': 'PROD0006'},
+            self.item('PROD0007', quantity=3, mrp=12),
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'added': 1, 'failed': [0, 1, 2, 3, 4, 5]})
+        self.assertEqual(self.rows('SELECT product_id FROM inventory'), [('PROD0007',)])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# Made with Bob
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for database initialization and migrations
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import database
+from database import sqlite3
+
+# billing, billing_items and inventory as created by the first release,
+# before bill_id, round_off, the GST split columns and buy_price existed
+LEGACY_SCHEMA = '''
+    CREATE TABLE inventory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id TEXT UNIQUE NOT NULL,
+        product_name TEXT NOT NULL,
+        hsn_code TEXT,
+        manufacture_date DATE,
+        expiry_month TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        unit_price REAL NOT NULL DEFAULT 0.0,
+        mrp REAL NOT NULL DEFAULT 0.0,
+        gst_percentage REAL NOT NULL DEFAULT 0.0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE billing (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER NOT NULL,
+        bill_date DATE NOT NULL,
+        subtotal REAL NOT NULL DEFAULT 0.0,
+        gst_amount REAL NOT NULL DEFAULT 0.0,
+        total_amount REAL NOT NULL DEFAULT 0.0,
+        payment_status TEXT DEFAULT 'Pending',
+        notes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE billing_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bill_id TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price REAL NOT NULL,
+        gst_percentage REAL NOT NULL,
+        total REAL NOT NULL
+    );
+    INSERT INTO billing (customer_id, bill_date) VALUES (1, '2024-01-01'), (1, '2024-01-02');
+'''
+
+class DatabaseTestCase(unittest.TestCase):
+    """Point the connection pool at a scratch database file for each test"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        database.close_pool()
+        self.saved_database = database.DATABASE
+        database.DATABASE = self.path
+
+    def tearDown(self):
+        database.close_pool()
+        database.DATABASE = self.saved_database
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+class InitDbTest(DatabaseTestCase):
+
+    def test_fresh_database(self):
+        database.init_db()
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], database.SCHEMA_VERSION)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM seller_info').fetchone()[0], 1)
+        conn.close()
+
+    def test_upgrades_legacy_schema(self):
+        conn = sqlite3.connect(self.path)
+        conn.executescript(LEGACY_SCHEMA)
+        conn.close()
+        
+        database.init_db()
+        
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], database.SCHEMA_VERSION)
+        # Missing columns are added and existing bills numbered in id order
+        self.assertEqual(conn.execute('SELECT bill_id FROM billing ORDER BY id').fetchall(), [('ST1',), ('ST2',)])
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(billing_items)')}
+        self.assertTrue({'cgst', 'sgst', 'igst', 'hsn_code'} <= columns)
+        # Indexes and triggers that read the new columns exist too
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+        self.assertIn('idx_billing_st_number', names)
+        self.assertIn('trg_billing_delete_items', names)
+        conn.close()
+
+    def test_rerun_is_noop(self):
+        database.init_db()
+        database.init_db()
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM seller_info').fetchone()[0], 1)
+        conn.close()
+
+    def test_rejects_old_sqlite(self):
+        with mock.patch.object(database, 'MIN_SQLITE_VERSION', (99, 0, 0)):
+            with self.assertRaisesRegex(RuntimeError, 'too old'):
+                database.init_db()
+
+if __name__ == '__main__':
+    unittest.main()
+
+# Made with Bob
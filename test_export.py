@@ -3,6 +3,8 @@
 Test script for active bills export functionality
 """
 
+import sys
+from collections import defaultdict
 from database import get_db_connection
 
 def test_active_bills_export():
@@ -41,46 +43,55 @@ def test_active_bills_export():
     
     print(f"\n✓ Found {len(bills)} active bills")
     
-    # Get items for each bill
+    # Get items for every active bill in one query, grouped by billing.id; the
+    # item's own bill_id comes back as an int for numeric bill numbers like '123'
+    items_by_bill = defaultdict(list)
+    for item in conn.execute('''
+        SELECT
+            b.id as bill_row_id,
+            bi.product_name,
+            i.hsn_code,
+            bi.quantity,
+            bi.unit_price,
+            bi.gst_percentage,
+            bi.igst,
+            bi.sgst,
+            bi.cgst,
+            bi.total
+        FROM billing b
+        JOIN billing_items bi ON bi.bill_id = b.bill_id
+        LEFT JOIN inventory i ON bi.product_id = i.id
+        WHERE b.payment_status != 'Cancelled'
+        ORDER BY b.id, bi.id
+    '''):
+        items_by_bill[item['bill_row_id']].append(item)
+    
     bills_with_items = []
     total_items = 0
+    out = []
     
     for bill in bills:
-        items = conn.execute('''
-            SELECT
-                bi.product_name,
-                i.hsn_code,
-                bi.quantity,
-                bi.unit_price,
-                bi.gst_percentage,
-                bi.igst,
-                bi.sgst,
-                bi.cgst,
-                bi.total
-            FROM billing_items bi
-            LEFT JOIN inventory i ON bi.product_id = i.id
-            WHERE bi.bill_id = ?
-            ORDER BY bi.id
-        ''', (bill['bill_id'],)).fetchall()
+        items = items_by_bill.get(bill['id'], [])
         
         bills_with_items.append({
             'bill': dict(bill),
-            'items': [dict(item) for item in items] if items else []
+            'items': [dict(item) for item in items]
         })
         
         total_items += len(items)
         
-        # Print bill details
-        print(f"\n  Bill {bill['bill_id']}:")
-        print(f"    Customer: {bill['customer_name']}")
-        print(f"    Date: {bill['bill_date']}")
-        print(f"    Total: ₹{bill['total_amount']:.2f}")
-        print(f"    Items: {len(items)}")
+        # Collect bill details, written out in one go after the loop
+        out.append(f"\n  Bill {bill['bill_id']}:\n")
+        out.append(f"    Customer: {bill['customer_name']}\n")
+        out.append(f"    Date: {bill['bill_date']}\n")
+        out.append(f"    Total: ₹{bill['total_amount']:.2f}\n")
+        out.append(f"    Items: {len(items)}\n")
         
-        if items:
-            for item in items:
-                print(f"      - {item['product_name']}: {item['quantity']} x ₹{item['unit_price']:.2f} = ₹{item['total']:.2f}")
-                print(f"        HSN: {item['hsn_code'] or 'N/A'}, IGST: ₹{item['igst']:.2f}, SGST: ₹{item['sgst']:.2f}, CGST: ₹{item['cgst']:.2f}")
+        for item in items:
+            out.append(f"      - {item['product_name']}: {item['quantity']} x ₹{item['unit_price']:.2f} = ₹{item['total']:.2f}\n")
+            out.append(f"        HSN: {item['hsn_code'] or 'N/A'}, IGST: ₹{item['igst']:.2f}, SGST: ₹{item['sgst']:.2f}, CGST: ₹{item['cgst']:.2f}\n")
+    
+    sys.stdout.write(''.join(out))
     
     conn.close()
     
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for inventory product ID generation
+"""
+
+import unittest
+
+import database
+from database import sqlite3
+from app import app
+from routes.inventory import _expiry_month
+from test_database import DatabaseTestCase
+
+FORM = {'product_name': 'Item', 'hsn_code': '1', 'manufacture_date': '2025-01-15', 'expiry_months': '12'}
+
+class ProductIdTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        database.init_db()
+        self.client = app.test_client()
+
+    def product_ids(self):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute('SELECT product_id FROM inventory ORDER BY id').fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+
+    def test_empty_product_id_is_generated(self):
+        self.client.post('/inventory/add', data=dict(FORM, product_id=''))
+        self.client.post('/inventory/add', data=dict(FORM, product_id=''))
+        self.assertEqual(self.product_ids(), ['PROD0001', 'PROD0002'])
+
+    def test_generated_id_ignores_stale_suggestion(self):
+        # The suggestion is cached until data_version() moves; a write it
+        # hasn't seen yet must not make the next add clash
+        self.assertEqual(self.client.get('/inventory/api/next-product-id').get_json(), {'product_id': 'PROD0001'})
+        conn = sqlite3.connect(self.path)
+        conn.execute("INSERT INTO inventory (product_id, product_name, expiry_month) VALUES ('PROD0001', 'Other', '2027-01')")
+        conn.commit()
+        conn.close()
+        
+        response = self.client.post('/inventory/add', data=dict(FORM, product_id=''))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.product_ids(), ['PROD0001', 'PROD0002'])
+
+    def test_duplicate_typed_id_is_rejected(self):
+        self.client.post('/inventory/add', data=dict(FORM, product_id='PROD0007'))
+        response = self.client.post('/inventory/add', data=dict(FORM, product_id='PROD0007', product_name='Second'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.product_ids(), ['PROD0007'])
+        # The form comes back filled in with what was submitted
+        self.assertIn('"product_name": "Second"', response.get_data(as_text=True))
+    
+    def test_invalid_update_keeps_submitted_values(self):
+        self.client.post('/inventory/add', data=dict(FORM, product_id='PROD0001'))
+        response = self.client.post('/inventory/update/1', data=dict(FORM, product_id='PROD0001', product_name='Renamed',
+                                                                     manufacture_date='15-01-2025'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('value="Renamed"', response.get_data(as_text=True))
+
+class ExpiryMonthTest(unittest.TestCase):
+    
+    def test_month_arithmetic(self):
+        self.assertEqual(_expiry_month('2025-01-31', '1'), '2025-02')
+        self.assertEqual(_expiry_month('2025-11-15', '14'), '2027-01')
+    
+    def test_rejects_other_date_forms(self):
+        for value in ('20240115', '2024-W03-1', '2024-1-5', '2025-02-30', '15-01-2024', ''):
+            with self.assertRaises(ValueError):
+                _expiry_month(value, '12')
+
+if __name__ == '__main__':
+    unittest.main()
+
+# Made with Bob